@@ -0,0 +1,136 @@
+"""启动耗时基准测试
+
+测量两项指标：
+1. 导入耗时：冷启动一个新解释器执行 `import main` 的时间（扣除空解释器启动时间），
+   并列出 `-X importtime` 中累计耗时最高的模块
+2. 首次响应耗时：启动 uvicorn 到 /health 首次返回 200、以及 /health/ready 返回 200 的时间
+
+用法:
+    python benchmarks/startup_benchmark.py [--runs 5] [--port 8765] [--top 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def _env() -> dict:
+    """子进程环境变量（未配置 API Key 时使用占位值，保证应用能启动）"""
+    env = os.environ.copy()
+    env.setdefault("GEMINI_API_KEY", "benchmark-placeholder")
+    return env
+
+
+def _run_python(code: str, *flags: str) -> tuple[float, str]:
+    """在新解释器中执行代码，返回墙钟耗时和 stderr"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        cwd=BASE_DIR,
+        env=_env(),
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return time.perf_counter() - started, result.stderr
+
+
+def measure_import(runs: int) -> dict:
+    """测量 `import main` 的耗时（秒）"""
+    baseline = [_run_python("pass")[0] for _ in range(runs)]
+    total = [_run_python("import main")[0] for _ in range(runs)]
+    base = statistics.median(baseline)
+    return {
+        "interpreter": base,
+        "import_main": statistics.median(total) - base,
+        "import_main_min": min(total) - base
+    }
+
+
+def heaviest_imports(top: int) -> list[tuple[str, float]]:
+    """解析 -X importtime 输出，返回累计耗时最高的顶层导入（毫秒）"""
+    _, stderr = _run_python("import main", "-X", "importtime")
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line.split("|")
+        try:
+            cumulative = int(parts[1].strip())
+        except ValueError:
+            continue
+        name = parts[2].rstrip()
+        # 只看顶层导入（缩进最少的一级）
+        if name.startswith(" ") and not name.startswith("  "):
+            entries.append((name.strip(), cumulative / 1000))
+    return sorted(entries, key=lambda e: e[1], reverse=True)[:top]
+
+
+def _wait_for(url: str, deadline: float) -> float | None:
+    """轮询 URL 直到返回 200，返回到达时间"""
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def measure_first_response(port: int, timeout: float = 60.0) -> dict:
+    """启动 uvicorn，测量首次响应 /health 与 /health/ready 的耗时（秒）"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BASE_DIR,
+        env=_env(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = started + timeout
+        live = _wait_for(f"http://127.0.0.1:{port}/health", deadline)
+        ready = _wait_for(f"http://127.0.0.1:{port}/health/ready", deadline)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return {
+        "first_health": live - started if live else None,
+        "first_ready": ready - started if ready else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pixel Factory 启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="导入耗时的测量次数")
+    parser.add_argument("--port", type=int, default=8765, help="首次响应测试使用的端口")
+    parser.add_argument("--top", type=int, default=10, help="列出最慢的导入数量")
+    args = parser.parse_args()
+
+    imports = measure_import(args.runs)
+    print(f"interpreter startup : {imports['interpreter'] * 1000:8.1f} ms")
+    print(f"import main (median): {imports['import_main'] * 1000:8.1f} ms")
+    print(f"import main (min)   : {imports['import_main_min'] * 1000:8.1f} ms")
+
+    print("\nheaviest top-level imports:")
+    for name, ms in heaviest_imports(args.top):
+        print(f"  {ms:8.1f} ms  {name}")
+
+    first = measure_first_response(args.port)
+    print()
+    for key, label in (("first_health", "time to /health"), ("first_ready", "time to /health/ready")):
+        value = first[key]
+        print(f"{label:<22}: " + (f"{value * 1000:8.1f} ms" if value is not None else "timeout"))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,17 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
+
+def _parse_weights(raw: str) -> dict[str, float]:
+    """解析客户端权重配置，格式: "token_a:3,token_b:1" """
+    weights = {}
+    for item in raw.split(","):
+        key, sep, value = item.strip().rpartition(":")
+        if sep and key:
+            weights[key] = float(value)
+    return weights
+
+
 class Settings:
     """应用配置"""
 
@@ -14,6 +25,25 @@ class Settings:
     # 使用 Gemini 3 Pro Image Preview 模型（Nano Banana Pro）
     GEMINI_MODEL: str = "gemini-3-pro-image-preview"
 
+    # 上游调用配置
+    # 单次请求超时（秒）
+    GEMINI_REQUEST_TIMEOUT: float = float(os.getenv("GEMINI_REQUEST_TIMEOUT", "120"))
+    # 上游调用线程池大小
+    GEMINI_MAX_WORKERS: int = int(os.getenv("GEMINI_MAX_WORKERS", "8"))
+    # 连续失败多少次后熔断
+    CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    # 熔断后多久进入半开探测（秒）
+    CIRCUIT_RECOVERY_TIMEOUT: float = float(os.getenv("CIRCUIT_RECOVERY_TIMEOUT", "30"))
+    # 交互式请求是否启用对冲请求
+    HEDGE_ENABLED: bool = os.getenv("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+    # 样本不足时的对冲延迟（秒），样本足够后使用最近成功调用的 P95 耗时
+    HEDGE_DELAY: float = float(os.getenv("HEDGE_DELAY", "20"))
+    HEDGE_MIN_SAMPLES: int = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    # 启动后是否在后台预热客户端（导入 SDK 并创建客户端）
+    GEMINI_WARMUP: bool = os.getenv("GEMINI_WARMUP", "true").lower() in ("1", "true", "yes")
+    # 预热时是否预先建立到上游的连接
+    GEMINI_WARMUP_CONNECT: bool = os.getenv("GEMINI_WARMUP_CONNECT", "true").lower() in ("1", "true", "yes")
+
     # 应用配置
     APP_NAME: str = "Pixel Factory"
     APP_VERSION: str = "1.0.0"
@@ -27,11 +57,34 @@ class Settings:
     TEMPLATES_DIR: Path = BASE_DIR / "templates"
     TEMPLATES_DATA_DIR: Path = BASE_DIR / "data" / "templates"
     TEMPLATES_FILE: Path = TEMPLATES_DATA_DIR / "user_templates.json"
+    DEDUP_INDEX_FILE: Path = BASE_DIR / "data" / "dedup" / "index.jsonl"
+    # 图片库变更日志（多个 worker 共享，用于增量列表）
+    GALLERY_LOG_FILE: Path = BASE_DIR / "data" / "gallery" / "changes.jsonl"
+
+    # 去重配置
+    # 保存时发现完全重复的图片是否替换为硬链接
+    DEDUP_HARDLINK: bool = os.getenv("DEDUP_HARDLINK", "false").lower() in ("1", "true", "yes")
+    # 相似图片查询的默认最大汉明距离（dHash 共 64 位）
+    DEDUP_MAX_DISTANCE: int = int(os.getenv("DEDUP_MAX_DISTANCE", "8"))
+
+    # 调度配置
+    # 同时执行的生成任务数
+    MAX_CONCURRENT_GENERATIONS: int = int(os.getenv("MAX_CONCURRENT_GENERATIONS", "4"))
+    # 批量任务最多占用的并发数（留出余量给交互式请求）
+    BULK_MAX_CONCURRENCY: int = int(os.getenv("BULK_MAX_CONCURRENCY", "3"))
+    # 各优先级的最大排队数，超过后返回 429
+    INTERACTIVE_QUEUE_LIMIT: int = int(os.getenv("INTERACTIVE_QUEUE_LIMIT", "32"))
+    BULK_QUEUE_LIMIT: int = int(os.getenv("BULK_QUEUE_LIMIT", "200"))
+    # 单个客户端在批量队列中的最大排队数，避免一个大批量请求占满整个队列
+    BULK_CLIENT_QUEUE_LIMIT: int = int(os.getenv("BULK_CLIENT_QUEUE_LIMIT", "50"))
+    # 客户端（API token 或 IP）的公平排队权重
+    CLIENT_WEIGHTS: dict[str, float] = _parse_weights(os.getenv("SCHEDULER_CLIENT_WEIGHTS", ""))
 
     # 支持的宽高比
     ASPECT_RATIOS: list[str] = ["1:1", "16:9", "9:16", "4:3", "3:4", "21:9", "9:21"]
 
-    def __init__(self):
+    def ensure_directories(self):
+        """创建运行所需的目录（在应用启动时调用，避免导入配置时产生文件系统操作）"""
         # 确保输出目录存在
         self.OUTPUT_DIR.mkdir(exist_ok=True)
         # 确保模板数据目录存在
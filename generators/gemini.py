@@ -1,33 +1,113 @@
 """Gemini 图片生成器"""
 import asyncio
 import base64
+import binascii
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-from typing import Optional
-
-from google import genai
-from google.genai import types
+from typing import TYPE_CHECKING, Optional
 
 from config import settings
+from generators.resilience import (
+    BREAKER_FAILURES,
+    ERROR_MESSAGES,
+    CircuitBreaker,
+    ErrorKind,
+    LatencyTracker,
+    classify_error,
+    get_breaker,
+)
+
+from services.gallery_service import normalize_filename, unique_output_path
+
+if TYPE_CHECKING:
+    from services.dedup_service import DedupService
 
 
 class GeminiImageGenerator:
     """Gemini 图片生成器（异步版本）"""
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, dedup_service: Optional["DedupService"] = None):
         """初始化 Gemini API 客户端"""
         self.api_key = api_key or settings.GEMINI_API_KEY
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY 未设置")
-        self.client = genai.Client(api_key=self.api_key)
+        self.request_timeout = settings.GEMINI_REQUEST_TIMEOUT
+        # google-genai 导入较慢，客户端在首次使用（或后台预热）时才创建
+        self._client = None
+        self._types = None
+        self._client_lock = threading.Lock()
+        # 后台预热（包括建立连接）结束后置为 True，无论成功与否
+        self._warmed_up = False
         # 使用 Gemini 3 Pro Image Preview 模型（Nano Banana Pro）
-        self.model_name = "gemini-3-pro-image-preview"
+        self.model_name = settings.GEMINI_MODEL
+        # 上游调用使用独立线程池，避免占满默认执行器
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.GEMINI_MAX_WORKERS,
+            thread_name_prefix="gemini"
+        )
+        self.breaker = get_breaker(
+            self.model_name,
+            failure_threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+            recovery_timeout=settings.CIRCUIT_RECOVERY_TIMEOUT
+        )
+        self.latency = LatencyTracker()
+        # 保存图片时同步更新去重索引（可选）
+        self.dedup_service = dedup_service
+
+    @property
+    def ready(self) -> bool:
+        """后台预热是否已结束（预热失败也视为结束，首次生成时会再次尝试创建客户端）"""
+        return self._warmed_up
+
+    def _ensure_client(self):
+        """首次使用时导入 SDK 并创建客户端（线程安全）"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from google import genai
+                    from google.genai import types
+
+                    self._types = types
+                    # 客户端自身的 HTTP 超时与外层超时一致，超时后线程能及时释放
+                    self._client = genai.Client(
+                        api_key=self.api_key,
+                        http_options=types.HttpOptions(timeout=int(self.request_timeout * 1000))
+                    )
+        return self._client
+
+    async def warm_up(self, connect: bool = True):
+        """
+        后台预热：导入 SDK、创建客户端，并可选地请求一次模型信息以建立连接
+
+        Args:
+            connect: 是否预先建立到上游的连接
+        """
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            client = await loop.run_in_executor(self.executor, self._ensure_client)
+            if connect:
+                await asyncio.wait_for(
+                    loop.run_in_executor(self.executor, lambda: client.models.get(model=self.model_name)),
+                    timeout=self.request_timeout
+                )
+            print(f"Gemini client warmed up in {time.monotonic() - started:.2f}s")
+        except Exception as e:
+            print(f"Gemini warm-up failed: {e!r}")
+        finally:
+            self._warmed_up = True
 
     async def generate_image(
         self,
         prompt: str,
         aspect_ratio: str = "1:1",
         filename: Optional[str] = None,
-        reference_image: Optional[str] = None
+        reference_image: Optional[str] = None,
+        hedge: bool = False
     ) -> dict:
         """
         生成单张图片
@@ -37,158 +117,248 @@ class GeminiImageGenerator:
             aspect_ratio: 宽高比，如 "1:1", "16:9", "9:16" 等
             filename: 输出文件名（可选）
             reference_image: 参考图片的 base64 数据（可选）
+            hedge: 是否在超过 P95 延迟后发起对冲请求（用于交互式调用）
 
         Returns:
-            包含图片信息的字典
+            包含图片信息的字典，失败时包含 error 和 error_code
         """
         if aspect_ratio not in settings.ASPECT_RATIOS:
             raise ValueError(f"不支持的宽高比: {aspect_ratio}")
 
-        loop = asyncio.get_event_loop()
-
-        try:
-            # 构建内容列表
-            contents = []
-
-            # 构建完整的提示词
-            aspect_ratio_prompts = {
-                "1:1": "正方形 (1:1)",
-                "16:9": "横向宽屏 (16:9)",
-                "9:16": "竖向 (9:16)",
-                "4:3": "横向 (4:3)",
-                "3:4": "竖向 (3:4)",
-                "21:9": "超宽屏 (21:9)",
-                "9:21": "超长竖向 (9:21)"
-            }
-
-            # 如果有参考图片，先添加参考图片
-            if reference_image:
-                # 处理 base64 数据
-                if ',' in reference_image:
-                    reference_image = reference_image.split(',', 1)[1]
-
-                # 解码 base64
-                reference_image_bytes = base64.b64decode(reference_image)
-
-                # 添加参考图片部分
-                contents.append(
-                    types.Part.from_bytes(
-                        data=reference_image_bytes,
-                        mime_type="image/png"
-                    )
-                )
-
-                # 添加文本提示词
-                text_prompt = f"这是参考图片。请根据这个参考图片的风格和内容，生成一张新图片。描述：{prompt}。图片宽高比要求：{aspect_ratio_prompts.get(aspect_ratio, aspect_ratio)}。"
-                contents.append(types.Part(text=text_prompt))
-            else:
-                # 没有参考图片，直接使用提示词
-                text_prompt = f"请生成一张图片。描述：{prompt}。图片宽高比要求：{aspect_ratio_prompts.get(aspect_ratio, aspect_ratio)}。"
-                contents.append(types.Part(text=text_prompt))
+        if self._client is None:
+            # 未预热时在线程池中导入 SDK，避免阻塞事件循环
+            try:
+                await asyncio.get_running_loop().run_in_executor(self.executor, self._ensure_client)
+            except Exception as e:
+                # SDK 缺失或客户端创建失败是本地问题，不计入熔断
+                print(f"Gemini client init failed: {e!r}")
+                return self._error(ErrorKind.CLIENT_UNAVAILABLE, prompt)
+        types = self._types
+
+        # 构建内容列表
+        contents = []
+
+        # 构建完整的提示词
+        aspect_ratio_prompts = {
+            "1:1": "正方形 (1:1)",
+            "16:9": "横向宽屏 (16:9)",
+            "9:16": "竖向 (9:16)",
+            "4:3": "横向 (4:3)",
+            "3:4": "竖向 (3:4)",
+            "21:9": "超宽屏 (21:9)",
+            "9:21": "超长竖向 (9:21)"
+        }
 
-            # 配置响应为图片格式
-            config = types.GenerateContentConfig(
-                response_modalities=["IMAGE"]
-            )
+        # 如果有参考图片，先添加参考图片
+        if reference_image:
+            # 处理 base64 数据
+            if ',' in reference_image:
+                reference_image = reference_image.split(',', 1)[1]
 
-            # 调用 Gemini 3 Pro Image Preview API
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=contents,
-                    config=config
+            # 解码 base64
+            try:
+                reference_image_bytes = base64.b64decode(reference_image)
+            except (binascii.Error, ValueError):
+                reference_image_bytes = b""
+            if not reference_image_bytes:
+                return self._error(ErrorKind.INVALID_REFERENCE_IMAGE, prompt)
+
+            # 添加参考图片部分
+            contents.append(
+                types.Part.from_bytes(
+                    data=reference_image_bytes,
+                    mime_type="image/png"
                 )
             )
 
-            # 检查响应中的图片
-            if response.candidates and len(response.candidates) > 0:
-                candidate = response.candidates[0]
+            # 添加文本提示词
+            text_prompt = f"这是参考图片。请根据这个参考图片的风格和内容，生成一张新图片。描述：{prompt}。图片宽高比要求：{aspect_ratio_prompts.get(aspect_ratio, aspect_ratio)}。"
+            contents.append(types.Part(text=text_prompt))
+        else:
+            # 没有参考图片，直接使用提示词
+            text_prompt = f"请生成一张图片。描述：{prompt}。图片宽高比要求：{aspect_ratio_prompts.get(aspect_ratio, aspect_ratio)}。"
+            contents.append(types.Part(text=text_prompt))
 
-                if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                    for part in candidate.content.parts:
-                        if hasattr(part, 'inline_data'):
-                            # inline_data 可能包含 bytes 或 base64 字符串
-                            inline_data = part.inline_data
+        # 配置响应为图片格式
+        config = types.GenerateContentConfig(
+            response_modalities=["IMAGE"]
+        )
 
-                            if hasattr(inline_data, 'data'):
-                                raw_data = inline_data.data
+        # 熔断器打开时直接失败，不再占用线程等待超时
+        if not self.breaker.allow_request():
+            error = self._error(ErrorKind.CIRCUIT_OPEN, prompt)
+            error["retry_after"] = self.breaker.retry_after()
+            return error
 
-                                # 处理数据（可能是 bytes 或 base64 字符串）
+        try:
+            # 调用 Gemini 3 Pro Image Preview API
+            response = await self._call_upstream(contents, config, hedge)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            kind = classify_error(e)
+            if kind in BREAKER_FAILURES:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            print(f"Gemini API failed [{kind.value}]: {e!r}")
+            if kind is ErrorKind.UNKNOWN:
+                import traceback
+                traceback.print_exc()
+            return self._error(kind, prompt)
+
+        # 上游有响应即视为健康（包括未返回图片的情况）
+        self.breaker.record_success()
+
+        # 检查响应中的图片
+        if response.candidates and len(response.candidates) > 0:
+            candidate = response.candidates[0]
+
+            if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts') and candidate.content.parts:
+                for part in candidate.content.parts:
+                    if getattr(part, 'inline_data', None):
+                        # inline_data 可能包含 bytes 或 base64 字符串
+                        inline_data = part.inline_data
+
+                        if hasattr(inline_data, 'data'):
+                            raw_data = inline_data.data
+
+                            # 处理数据（可能是 bytes 或 base64 字符串）
+                            try:
                                 if isinstance(raw_data, bytes):
                                     image_data = raw_data
                                 elif isinstance(raw_data, str):
                                     image_data = base64.b64decode(raw_data)
                                 else:
                                     image_data = base64.b64decode(str(raw_data))
-
-                                if image_data:
-                                    return self._save_image(image_data, prompt, aspect_ratio, filename)
-
-        except Exception as e:
-            print(f"Gemini API failed: {e}")
-            import traceback
-            traceback.print_exc()
-
+                            except (binascii.Error, ValueError) as e:
+                                print(f"Decoding image data failed: {e!r}")
+                                return self._error(ErrorKind.INVALID_IMAGE_DATA, prompt)
+
+                            if image_data:
+                                # 写文件和计算哈希放到线程池，避免阻塞事件循环
+                                try:
+                                    return await asyncio.get_running_loop().run_in_executor(
+                                        None, self._save_image, image_data, prompt, aspect_ratio, filename
+                                    )
+                                except OSError as e:
+                                    # 本地写盘失败，上游已正常返回，不计入熔断
+                                    print(f"Saving image failed: {e!r}")
+                                    return self._error(ErrorKind.SAVE_FAILED, prompt)
+
+            finish_reason = str(getattr(candidate, 'finish_reason', '') or '')
+            if any(reason in finish_reason for reason in ("SAFETY", "PROHIBITED", "BLOCKLIST", "IMAGE_SAFETY")):
+                return self._error(ErrorKind.CONTENT_BLOCKED, prompt)
+
+        if getattr(getattr(response, 'prompt_feedback', None), 'block_reason', None):
+            return self._error(ErrorKind.CONTENT_BLOCKED, prompt)
+
+        return self._error(ErrorKind.NO_IMAGE, prompt)
+
+    def _error(self, kind: ErrorKind, prompt: str) -> dict:
+        """构建失败结果"""
         return {
             "success": False,
-            "error": "无法生成图片，请检查 API 密钥和模型配置",
+            "error": ERROR_MESSAGES[kind],
+            "error_code": kind.value,
             "prompt": prompt
         }
 
-    def _save_image(self, image_data: bytes, prompt: str, aspect_ratio: str, filename: Optional[str] = None) -> dict:
-        """保存图片并返回结果"""
-        # 确定输出路径
-        if filename:
-            output_path = settings.OUTPUT_DIR / filename
-        else:
-            existing_count = len(list(settings.OUTPUT_DIR.glob('*.png')))
-            output_path = settings.OUTPUT_DIR / f"image_{existing_count + 1}.png"
+    def _submit(self, contents: list, config) -> asyncio.Future:
+        """在线程池中发起一次上游调用，并记录成功调用的耗时"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
 
-        # 保存图片
-        output_path.write_bytes(image_data)
+        def call():
+            response = self._client.models.generate_content(
+                model=self.model_name,
+                contents=contents,
+                config=config
+            )
+            self.latency.record(time.monotonic() - started)
+            return response
 
-        return {
+        future = loop.run_in_executor(self.executor, call)
+        # 被放弃的请求的异常无需处理，避免 "exception was never retrieved" 警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return future
+
+    async def _call_upstream(self, contents: list, config, hedge: bool):
+        """
+        调用上游接口，带超时与可选的对冲请求
+
+        对冲：首个请求超过最近 P95 耗时仍未返回时再发一个相同请求，取先成功的结果。
+        只在熔断器关闭时对冲，避免在上游故障时放大流量。
+        """
+        if len(self.latency) >= settings.HEDGE_MIN_SAMPLES:
+            hedge_delay = self.latency.percentile(95)
+        else:
+            hedge_delay = settings.HEDGE_DELAY
+
+        primary = self._submit(contents, config)
+        if not hedge or hedge_delay >= self.request_timeout:
+            return await asyncio.wait_for(primary, timeout=self.request_timeout)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_timeout
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        if done or self.breaker.state != CircuitBreaker.CLOSED:
+            return await asyncio.wait_for(primary, timeout=max(deadline - loop.time(), 0))
+
+        pending = {primary, self._submit(contents, config)}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=max(deadline - loop.time(), 0),
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                raise asyncio.TimeoutError()
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def close(self):
+        """释放上游调用线程池"""
+        self.executor.shutdown(wait=False)
+
+    def _save_image(self, image_data: bytes, prompt: str, aspect_ratio: str, filename: Optional[str] = None) -> dict:
+        """保存图片并返回结果"""
+        # 未指定文件名时用时间戳 + 随机后缀命名，不需要遍历输出目录
+        filename = normalize_filename(filename) if filename else None
+        if not filename:
+            filename = f"image_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}.png"
+
+        # 以独占方式创建文件：文件名已存在（包括被其他线程 / worker 抢先创建）时换一个名字，不覆盖已有图片
+        while True:
+            output_path = unique_output_path(filename)
+            try:
+                with output_path.open("xb") as f:
+                    f.write(image_data)
+                break
+            except FileExistsError:
+                continue
+        # 去重时文件可能被替换为硬链接（mtime 随源文件），先记下保存时间
+        created_at = output_path.stat().st_mtime
+
+        result = {
             "success": True,
             "filename": output_path.name,
             "path": str(output_path),
             "prompt": prompt,
-            "aspect_ratio": aspect_ratio
+            "aspect_ratio": aspect_ratio,
+            "created_at": created_at
         }
 
-    async def generate_batch(
-        self,
-        prompts: list[str],
-        aspect_ratio: str = "1:1"
-    ) -> list[dict]:
-        """
-        批量生成图片
-
-        Args:
-            prompts: 提示词列表
-            aspect_ratio: 宽高比
-
-        Returns:
-            生成结果列表
-        """
-        tasks = [
-            self.generate_image(prompt, aspect_ratio)
-            for prompt in prompts
-        ]
-        return await asyncio.gather(*tasks)
+        # 更新去重索引
+        if self.dedup_service:
+            try:
+                result["duplicate_of"] = self.dedup_service.add(output_path.name, image_data)["duplicate_of"]
+            except Exception as e:
+                print(f"Dedup index update failed: {e!r}")
 
-    def get_generated_images(self) -> list[dict]:
-        """
-        获取已生成的图片列表
-
-        Returns:
-            图片信息列表
-        """
-        images = []
-        for path in sorted(settings.OUTPUT_DIR.glob('*.png')):
-            images.append({
-                "filename": path.name,
-                "url": f"/api/images/{path.name}",
-                "created_at": path.stat().st_mtime
-            })
-        return images
+        return result
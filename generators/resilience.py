@@ -0,0 +1,191 @@
+"""上游调用的容错工具：熔断器、延迟统计与错误分类"""
+import asyncio
+import math
+import time
+from collections import deque
+from enum import Enum
+from typing import Optional
+
+
+class ErrorKind(str, Enum):
+    """生成失败的错误分类"""
+    TIMEOUT = "timeout"
+    CIRCUIT_OPEN = "circuit_open"
+    RATE_LIMITED = "rate_limited"
+    AUTH_ERROR = "auth_error"
+    INVALID_REQUEST = "invalid_request"
+    UPSTREAM_ERROR = "upstream_error"
+    NETWORK_ERROR = "network_error"
+    CONTENT_BLOCKED = "content_blocked"
+    NO_IMAGE = "no_image"
+    INVALID_REFERENCE_IMAGE = "invalid_reference_image"
+    CLIENT_UNAVAILABLE = "client_unavailable"
+    INVALID_IMAGE_DATA = "invalid_image_data"
+    SAVE_FAILED = "save_failed"
+    UNKNOWN = "unknown"
+
+
+ERROR_MESSAGES = {
+    ErrorKind.TIMEOUT: "上游接口响应超时",
+    ErrorKind.CIRCUIT_OPEN: "上游接口暂时不可用，已暂停请求",
+    ErrorKind.RATE_LIMITED: "上游接口限流，请稍后重试",
+    ErrorKind.AUTH_ERROR: "API 密钥无效或无权访问该模型",
+    ErrorKind.INVALID_REQUEST: "请求参数被上游拒绝",
+    ErrorKind.UPSTREAM_ERROR: "上游接口服务异常",
+    ErrorKind.NETWORK_ERROR: "无法连接上游接口",
+    ErrorKind.CONTENT_BLOCKED: "提示词或参考图片触发了内容安全策略",
+    ErrorKind.NO_IMAGE: "模型未返回图片",
+    ErrorKind.INVALID_REFERENCE_IMAGE: "参考图片数据无效",
+    ErrorKind.CLIENT_UNAVAILABLE: "Gemini SDK 初始化失败，请检查依赖和 API 密钥配置",
+    ErrorKind.INVALID_IMAGE_DATA: "模型返回的图片数据无法解码",
+    ErrorKind.SAVE_FAILED: "图片保存失败，请检查输出目录和磁盘空间",
+    ErrorKind.UNKNOWN: "无法生成图片，请检查 API 密钥和模型配置",
+}
+
+# 说明上游不健康、需要计入熔断的错误
+BREAKER_FAILURES = {
+    ErrorKind.TIMEOUT,
+    ErrorKind.RATE_LIMITED,
+    ErrorKind.UPSTREAM_ERROR,
+    ErrorKind.NETWORK_ERROR,
+    ErrorKind.UNKNOWN,
+}
+
+
+def classify_error(exc: BaseException) -> ErrorKind:
+    """
+    将上游调用抛出的异常归类
+
+    按鸭子类型判断（SDK 的 APIError 带有 HTTP 状态码 code），避免依赖具体的 SDK / httpx 异常类型。
+    """
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return ErrorKind.TIMEOUT
+
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        if code == 429:
+            return ErrorKind.RATE_LIMITED
+        if code in (401, 403):
+            return ErrorKind.AUTH_ERROR
+        if code >= 500:
+            return ErrorKind.UPSTREAM_ERROR
+        if 400 <= code < 500:
+            return ErrorKind.INVALID_REQUEST
+
+    name = type(exc).__name__
+    if "Timeout" in name:
+        return ErrorKind.TIMEOUT
+    if "Connect" in name or "Network" in name or isinstance(exc, ConnectionError):
+        return ErrorKind.NETWORK_ERROR
+    return ErrorKind.UNKNOWN
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    - closed: 正常放行，连续失败达到阈值后进入 open
+    - open: 直接拒绝，冷却时间过后进入 half_open
+    - half_open: 只放行少量探测请求，成功则恢复 closed，失败则重新 open
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+
+    @property
+    def state(self) -> str:
+        """当前状态（冷却结束的 open 视为 half_open）"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    def allow_request(self) -> bool:
+        """是否放行一次请求；放行后必须调用 record_success / record_failure / release 之一"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+            self._half_open_calls += 1
+            return True
+        return False
+
+    def record_success(self):
+        """记录一次成功调用"""
+        self._failures = 0
+        if self._state != self.CLOSED:
+            print(f"Circuit '{self.name}' closed")
+        self._state = self.CLOSED
+        self._half_open_calls = 0
+
+    def record_failure(self):
+        """记录一次失败调用"""
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                print(f"Circuit '{self.name}' opened after {self._failures} failures")
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._half_open_calls = 0
+
+    def release(self):
+        """放行的请求未产生结果（如被取消）时归还探测名额"""
+        if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def retry_after(self) -> int:
+        """距离下一次探测的秒数"""
+        if self._state != self.OPEN:
+            return 1
+        remaining = self.recovery_timeout - (time.monotonic() - self._opened_at)
+        return max(1, math.ceil(remaining))
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(model_name: str, **kwargs) -> CircuitBreaker:
+    """获取（或创建）某个模型的熔断器，同一进程内按模型共享"""
+    if model_name not in _breakers:
+        _breakers[model_name] = CircuitBreaker(model_name, **kwargs)
+    return _breakers[model_name]
+
+
+class LatencyTracker:
+    """记录最近成功调用的耗时，用于计算对冲请求的触发延迟"""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        """记录一次耗时"""
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """耗时分位数，无样本时返回 None"""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1)
+        return ordered[max(index, 0)]
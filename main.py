@@ -1,15 +1,23 @@
 """Pixel Factory - 图像产出工厂"""
 from __future__ import annotations
 
-from fastapi import FastAPI, HTTPException, Request
+import asyncio
+import hashlib
+import ipaddress
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from contextlib import asynccontextmanager
+from pathlib import Path
 
 from config import settings
 from generators.gemini import GeminiImageGenerator
 from services.template_service import TemplateService
+from services.dedup_service import DedupService
+from services.gallery_service import GalleryService, normalize_filename, unique_output_path
+from services.scheduler import GenerationScheduler, Priority, QueueFullError
 from models.schemas import (
     GenerateRequest,
     GenerateResponse,
@@ -18,6 +26,10 @@ from models.schemas import (
     ImagesListResponse,
     ImageInfo,
     HealthResponse,
+    SchedulerStatsResponse,
+    SimilarImage,
+    SimilarImagesResponse,
+    DedupHardlinkResponse,
     CreateTemplateRequest,
     TemplateListResponse,
     TemplateResponse,
@@ -27,19 +39,47 @@ from models.schemas import (
 
 # 全局生成器实例
 generator: GeminiImageGenerator | None = None
+# 全局调度器实例
+scheduler: GenerationScheduler | None = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    global generator
+    global generator, scheduler
     # 启动时初始化
-    generator = GeminiImageGenerator()
+    settings.ensure_directories()
+    # 初始化去重索引，在后台加载并与输出目录对账
+    app.state.dedup_service = DedupService()
+    dedup_task = asyncio.create_task(asyncio.to_thread(app.state.dedup_service.sync_directory))
+    generator = GeminiImageGenerator(dedup_service=app.state.dedup_service)
+    # 初始化图片库索引（首次完整列表时扫描输出目录）
+    app.state.gallery_service = GalleryService()
+    # SDK 导入和客户端创建放到后台，不阻塞启动
+    warmup_task = None
+    if settings.GEMINI_WARMUP:
+        warmup_task = asyncio.create_task(generator.warm_up(connect=settings.GEMINI_WARMUP_CONNECT))
+    scheduler = GenerationScheduler(
+        max_concurrency=settings.MAX_CONCURRENT_GENERATIONS,
+        bulk_max_concurrency=settings.BULK_MAX_CONCURRENCY,
+        queue_limits={
+            Priority.INTERACTIVE: settings.INTERACTIVE_QUEUE_LIMIT,
+            Priority.BULK: settings.BULK_QUEUE_LIMIT
+        },
+        client_queue_limits={Priority.BULK: settings.BULK_CLIENT_QUEUE_LIMIT},
+        client_weights=_CLIENT_WEIGHTS
+    )
     # 初始化模板服务
     app.state.template_service = TemplateService()
     yield
     # 关闭时清理
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    if not dedup_task.done():
+        dedup_task.cancel()
+    generator.close()
     generator = None
+    scheduler = None
 
 
 # 创建 FastAPI 应用
@@ -51,10 +91,61 @@ app = FastAPI(
 
 # 挂载静态文件和模板
 app.mount("/static", StaticFiles(directory=str(settings.STATIC_DIR)), name="static")
-app.mount("/generated_images", StaticFiles(directory=str(settings.OUTPUT_DIR)), name="generated_images")
+# 输出目录在启动时才创建，这里不检查目录是否存在
+app.mount(
+    "/generated_images",
+    StaticFiles(directory=str(settings.OUTPUT_DIR), check_dir=False),
+    name="generated_images"
+)
 templates = Jinja2Templates(directory=str(settings.TEMPLATES_DIR))
 
 
+def _token_id(token: str) -> str:
+    """API token 的调度标识（哈希后使用，不在内存中以原文作为键）"""
+    return "token:" + hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+
+def _is_ip(value: str) -> bool:
+    """配置的权重键是否为 IP 地址"""
+    try:
+        ipaddress.ip_address(value)
+    except ValueError:
+        return False
+    return True
+
+
+# 调度器使用的客户端权重：IP 原样作为键，token 换成哈希标识
+_CLIENT_WEIGHTS = {
+    key if _is_ip(key) else _token_id(key): weight
+    for key, weight in settings.CLIENT_WEIGHTS.items()
+}
+
+
+def _client_id(request: Request) -> str:
+    """
+    获取用于公平调度的客户端标识
+
+    应用不校验 token，只有在 SCHEDULER_CLIENT_WEIGHTS 中配置过的 token 才作为独立客户端，
+    其余请求按客户端 IP 区分，避免每次换一个随机 token 绕过单客户端排队上限。
+    """
+    auth = request.headers.get("authorization", "")
+    token = auth[7:].strip() if auth.lower().startswith("bearer ") else request.headers.get("x-api-key")
+    if token:
+        token_id = _token_id(token)
+        if token_id in _CLIENT_WEIGHTS:
+            return token_id
+    return request.client.host if request.client else "anonymous"
+
+
+def _queue_full(error: QueueFullError) -> HTTPException:
+    """将队列满异常转换为 429 响应"""
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
 @app.get("/")
 async def index(request: Request):
     """首页 - Web 界面"""
@@ -68,70 +159,143 @@ async def index(request: Request):
     )
 
 
+def _is_ready() -> bool:
+    """生成器是否就绪（未开启预热时，初始化完成即视为就绪）"""
+    if not generator:
+        return False
+    return generator.ready or not settings.GEMINI_WARMUP
+
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    """健康检查"""
+    """存活检查（进程可响应即返回 ok，ready 字段表示是否就绪）"""
     return HealthResponse(
         status="ok",
         app_name=settings.APP_NAME,
-        version=settings.APP_VERSION
+        version=settings.APP_VERSION,
+        ready=_is_ready()
     )
 
 
+@app.get("/health/ready", response_model=HealthResponse)
+async def readiness_check():
+    """就绪检查（生成器预热完成前返回 503）"""
+    ready = _is_ready()
+    response = HealthResponse(
+        status="ready" if ready else "starting",
+        app_name=settings.APP_NAME,
+        version=settings.APP_VERSION,
+        ready=ready
+    )
+    if not ready:
+        return JSONResponse(status_code=503, content=response.model_dump())
+    return response
+
+
+@app.get("/api/scheduler/stats", response_model=SchedulerStatsResponse)
+async def scheduler_stats():
+    """
+    获取调度器指标（排队深度、等待时间等）
+
+    Returns:
+        各优先级的调度指标
+    """
+    if not scheduler:
+        raise HTTPException(status_code=503, detail="调度器未初始化")
+
+    return SchedulerStatsResponse(**scheduler.get_stats())
+
+
 @app.post("/api/generate", response_model=GenerateResponse)
-async def generate_image(request: GenerateRequest):
+async def generate_image(request: GenerateRequest, http_request: Request, response: Response):
     """
-    生成单张图片
+    生成单张图片（交互式优先级）
 
     Args:
         request: 图片生成请求
+        http_request: 原始 HTTP 请求，用于识别客户端
+        response: 响应对象，熔断时用于设置 Retry-After 头
 
     Returns:
         生成结果
     """
-    if not generator:
+    if not generator or not scheduler:
         raise HTTPException(status_code=503, detail="生成器未初始化")
 
-    result = await generator.generate_image(
-        prompt=request.prompt,
-        aspect_ratio=request.aspect_ratio,
-        reference_image=request.reference_image
-    )
+    try:
+        result = await scheduler.run(
+            lambda: generator.generate_image(
+                prompt=request.prompt,
+                aspect_ratio=request.aspect_ratio,
+                reference_image=request.reference_image,
+                filename=request.filename,
+                hedge=settings.HEDGE_ENABLED
+            ),
+            client_id=_client_id(http_request),
+            priority=Priority.INTERACTIVE
+        )
+    except QueueFullError as e:
+        raise _queue_full(e)
 
     if result["success"]:
+        # 记录变更需要获取跨进程文件锁，放到线程中执行，避免阻塞事件循环
+        await asyncio.to_thread(app.state.gallery_service.record, result["filename"], result.get("created_at"))
         return GenerateResponse(
             success=True,
             filename=result["filename"],
             path=result["path"],
             url=f"/api/images/{result['filename']}",
-            prompt=result["prompt"]
+            prompt=result["prompt"],
+            duplicate_of=result.get("duplicate_of")
         )
     else:
+        retry_after = result.get("retry_after")
+        if retry_after is not None:
+            response.headers["Retry-After"] = str(retry_after)
         return GenerateResponse(
             success=False,
             error=result.get("error", "生成失败"),
+            error_code=result.get("error_code"),
+            retry_after=retry_after,
             prompt=request.prompt
         )
 
 
 @app.post("/api/generate/batch", response_model=BatchGenerateResponse)
-async def generate_batch(request: BatchGenerateRequest):
+async def generate_batch(request: BatchGenerateRequest, http_request: Request):
     """
-    批量生成图片
+    批量生成图片（批量优先级，每个提示词单独排队）
 
     Args:
         request: 批量生成请求
+        http_request: 原始 HTTP 请求，用于识别客户端
 
     Returns:
         批量生成结果
     """
-    if not generator:
+    if not generator or not scheduler:
         raise HTTPException(status_code=503, detail="生成器未初始化")
 
-    results = await generator.generate_batch(
-        prompts=request.prompts,
-        aspect_ratio=request.aspect_ratio
-    )
+    # 超过单次可接纳上限的批量永远无法入队，直接拒绝而不是返回 429
+    capacity = scheduler.capacity(Priority.BULK)
+    if len(request.prompts) > capacity:
+        raise HTTPException(
+            status_code=413,
+            detail=f"单次批量最多 {capacity} 个提示词，请拆分后提交"
+        )
+
+    try:
+        futures = scheduler.submit_many(
+            [
+                lambda prompt=prompt: generator.generate_image(prompt, request.aspect_ratio)
+                for prompt in request.prompts
+            ],
+            client_id=_client_id(http_request),
+            priority=Priority.BULK
+        )
+    except QueueFullError as e:
+        raise _queue_full(e)
+    results = await asyncio.gather(*futures)
 
     response_results = []
     succeeded = 0
@@ -139,18 +303,22 @@ async def generate_batch(request: BatchGenerateRequest):
 
     for result in results:
         if result["success"]:
+            await asyncio.to_thread(app.state.gallery_service.record, result["filename"], result.get("created_at"))
             response_results.append(GenerateResponse(
                 success=True,
                 filename=result["filename"],
                 path=result["path"],
                 url=f"/api/images/{result['filename']}",
-                prompt=result["prompt"]
+                prompt=result["prompt"],
+                duplicate_of=result.get("duplicate_of")
             ))
             succeeded += 1
         else:
             response_results.append(GenerateResponse(
                 success=False,
                 error=result.get("error", "生成失败"),
+                error_code=result.get("error_code"),
+                retry_after=result.get("retry_after"),
                 prompt=result["prompt"]
             ))
             failed += 1
@@ -165,20 +333,24 @@ async def generate_batch(request: BatchGenerateRequest):
 
 
 @app.get("/api/images", response_model=ImagesListResponse)
-async def list_images():
+async def list_images(since: str | None = None):
     """
     获取已生成的图片列表
 
+    Args:
+        since: 上次返回的游标，提供时只返回之后新增 / 变化 / 删除的图片
+
     Returns:
-        图片列表
+        图片列表（增量或完整）
     """
-    if not generator:
-        raise HTTPException(status_code=503, detail="生成器未初始化")
-
-    images = generator.get_generated_images()
+    gallery_service = app.state.gallery_service
+    result = await asyncio.to_thread(gallery_service.list_images, since)
     return ImagesListResponse(
-        images=[ImageInfo(**img) for img in images],
-        total=len(images)
+        images=[ImageInfo(**img) for img in result["images"]],
+        total=len(result["images"]),
+        removed=result["removed"],
+        cursor=result["cursor"],
+        reset=result["reset"]
     )
 
 
@@ -199,6 +371,55 @@ async def get_image(filename: str):
     return FileResponse(image_path)
 
 
+@app.get("/api/images/{filename}/similar", response_model=SimilarImagesResponse)
+async def find_similar_images(
+    filename: str,
+    max_distance: int | None = Query(None, ge=0, le=64),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    查找与指定图片完全相同或视觉相似的图片
+
+    Args:
+        filename: 图片文件名
+        max_distance: dHash 最大汉明距离（0-64），默认使用配置值
+        limit: 最多返回数量（1-500）
+
+    Returns:
+        相似图片列表
+    """
+    if max_distance is None:
+        max_distance = settings.DEDUP_MAX_DISTANCE
+
+    dedup_service = app.state.dedup_service
+    similar = await asyncio.to_thread(dedup_service.find_similar, filename, max_distance, limit)
+    if similar is None:
+        raise HTTPException(status_code=404, detail="图片不存在或尚未建立索引")
+
+    images = [
+        SimilarImage(url=f"/api/images/{item['filename']}", **item)
+        for item in similar
+    ]
+    return SimilarImagesResponse(
+        filename=filename,
+        images=images,
+        total=len(images)
+    )
+
+
+@app.post("/api/dedup/hardlink", response_model=DedupHardlinkResponse)
+async def hardlink_duplicates():
+    """
+    将内容完全相同的图片硬链接到同一份数据，节省磁盘空间
+
+    Returns:
+        硬链接的文件数和节省的字节数
+    """
+    dedup_service = app.state.dedup_service
+    result = await asyncio.to_thread(dedup_service.hardlink_duplicates)
+    return DedupHardlinkResponse(success=True, **result)
+
+
 @app.post("/api/rename")
 async def rename_image(request: dict):
     """
@@ -216,9 +437,10 @@ async def rename_image(request: dict):
     if not old_filename or not new_filename:
         raise HTTPException(status_code=400, detail="缺少文件名参数")
 
-    # 确保 .png 扩展名
-    if not new_filename.lower().endswith('.png'):
-        new_filename += '.png'
+    old_filename = Path(old_filename).name
+    new_filename = normalize_filename(new_filename)
+    if not new_filename:
+        raise HTTPException(status_code=400, detail="文件名无效")
 
     old_path = settings.OUTPUT_DIR / old_filename
     new_path = settings.OUTPUT_DIR / new_filename
@@ -230,15 +452,18 @@ async def rename_image(request: dict):
         }
 
     # 如果新文件名已存在，添加时间戳
-    if new_path.exists() and new_path != old_path:
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        name_without_ext = new_filename.rsplit('.', 1)[0]
-        new_filename = f"{name_without_ext}_{timestamp}.png"
-        new_path = settings.OUTPUT_DIR / new_filename
+    if new_path != old_path:
+        new_path = unique_output_path(new_filename)
+        new_filename = new_path.name
 
-    try:
+    def rename_and_reindex():
         old_path.rename(new_path)
+        app.state.dedup_service.rename(old_filename, new_filename)
+        app.state.gallery_service.rename(old_filename, new_filename)
+
+    try:
+        # 索引更新需要获取跨进程文件锁，放到线程中执行，避免阻塞事件循环
+        await asyncio.to_thread(rename_and_reindex)
         return {
             "success": True,
             "filename": new_filename,
@@ -20,6 +20,11 @@ class GenerateRequest(BaseModel):
         None,
         description="参考图片的 base64 数据（可选）"
     )
+    filename: Optional[str] = Field(
+        None,
+        description="输出文件名（可选），已存在时自动添加时间戳",
+        max_length=200
+    )
 
 
 class BatchGenerateRequest(BaseModel):
@@ -39,7 +44,10 @@ class GenerateResponse(BaseModel):
     path: Optional[str] = None
     url: Optional[str] = None
     error: Optional[str] = None
+    error_code: Optional[str] = Field(None, description="错误分类，如 timeout、circuit_open、rate_limited")
+    retry_after: Optional[int] = Field(None, description="熔断时距离下一次探测的秒数，建议在此之后重试")
     prompt: Optional[str] = None
+    duplicate_of: Optional[str] = Field(None, description="内容完全相同的已有图片文件名")
 
 
 class BatchGenerateResponse(BaseModel):
@@ -62,6 +70,31 @@ class ImagesListResponse(BaseModel):
     """图片列表响应"""
     images: list[ImageInfo]
     total: int
+    removed: list[str] = Field(default_factory=list, description="自游标以来被删除的文件名")
+    cursor: Optional[str] = Field(None, description="下次增量查询使用的游标")
+    reset: bool = Field(True, description="是否为完整列表（游标为空或失效时）")
+
+
+class SimilarImage(BaseModel):
+    """相似图片"""
+    filename: str
+    url: str
+    distance: int = Field(..., description="dHash 汉明距离，0 表示感知上相同")
+    exact: bool = Field(..., description="内容是否完全相同")
+
+
+class SimilarImagesResponse(BaseModel):
+    """相似图片查询响应"""
+    filename: str
+    images: list[SimilarImage]
+    total: int
+
+
+class DedupHardlinkResponse(BaseModel):
+    """重复图片硬链接响应"""
+    success: bool
+    linked: int
+    bytes_saved: int
 
 
 class HealthResponse(BaseModel):
@@ -69,6 +102,31 @@ class HealthResponse(BaseModel):
     status: str
     app_name: str
     version: str
+    ready: bool = Field(False, description="生成器是否已就绪，可以接收流量")
+
+
+class SchedulerClassStats(BaseModel):
+    """单个优先级的调度指标"""
+    queue_depth: int
+    queue_limit: int
+    client_queue_limit: Optional[int] = Field(None, description="单个客户端的最大排队数")
+    queued_clients: int = Field(..., description="有任务在排队的客户端数")
+    running: int
+    admitted: int
+    rejected: int
+    completed: int
+    cancelled: int = Field(..., description="排队期间被取消的任务数")
+    wait_avg: float = Field(..., description="平均排队等待时间（秒）")
+    wait_p50: float = Field(..., description="排队等待时间 P50（秒）")
+    wait_p95: float = Field(..., description="排队等待时间 P95（秒）")
+    wait_max: float = Field(..., description="最长排队等待时间（秒）")
+
+
+class SchedulerStatsResponse(BaseModel):
+    """调度器指标响应"""
+    max_concurrency: int
+    bulk_max_concurrency: int
+    classes: dict[str, SchedulerClassStats]
 
 
 # ===== 用户模板相关模型 =====
@@ -0,0 +1,375 @@
+"""生成图片的去重索引服务
+
+- 完全重复：SHA-256 内容哈希
+- 近似重复：64 位 dHash 感知哈希，存放在 BK 树中按汉明距离检索，插入与查询都不需要全量扫描
+
+索引以追加写的 JSONL 日志持久化（add / remove / rename），日志冗余过多时压缩。
+多个 worker 共享同一个日志：写入在文件锁内进行，每次读写前先读取其他 worker 追加的记录。
+"""
+import hashlib
+import io
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from config import settings
+from services.shared_log import SharedLog, file_lock
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """两个哈希值的汉明距离"""
+    return bin(a ^ b).count("1")
+
+
+def compute_dhash(image_data: bytes, hash_size: int = 8) -> Optional[int]:
+    """
+    计算图片的 dHash（差异哈希）
+
+    Args:
+        image_data: 图片二进制数据
+        hash_size: 哈希边长，结果为 hash_size * hash_size 位
+
+    Returns:
+        哈希值；缺少 Pillow / NumPy 或图片无法解码时返回 None
+    """
+    try:
+        import numpy as np
+        from PIL import Image
+    except ImportError:
+        return None
+
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            gray = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    except Exception:
+        return None
+
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+class _BKNode:
+    """BK 树节点，相同哈希的文件共用一个节点"""
+    __slots__ = ("hash", "filenames", "children")
+
+    def __init__(self, value: int):
+        self.hash = value
+        self.filenames: set[str] = set()
+        self.children: dict[int, "_BKNode"] = {}
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树"""
+
+    def __init__(self):
+        self._root: Optional[_BKNode] = None
+
+    def add(self, value: int, filename: str):
+        """插入一个哈希值"""
+        if self._root is None:
+            self._root = _BKNode(value)
+            self._root.filenames.add(filename)
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node.hash)
+            if distance == 0:
+                node.filenames.add(filename)
+                return
+            child = node.children.get(distance)
+            if child is None:
+                child = _BKNode(value)
+                child.filenames.add(filename)
+                node.children[distance] = child
+                return
+            node = child
+
+    def remove(self, value: int, filename: str):
+        """移除文件（节点保留，只清除文件名）"""
+        node = self._root
+        while node is not None:
+            distance = hamming_distance(value, node.hash)
+            if distance == 0:
+                node.filenames.discard(filename)
+                return
+            node = node.children.get(distance)
+
+    def search(self, value: int, max_distance: int) -> list[tuple[int, str]]:
+        """
+        查找距离不超过 max_distance 的所有文件
+
+        Returns:
+            (距离, 文件名) 列表，按距离升序
+        """
+        results = []
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node.hash)
+            if distance <= max_distance:
+                results.extend((distance, name) for name in node.filenames)
+            # 三角不等式：只有距离在 [d - k, d + k] 内的子树可能命中
+            for edge, child in node.children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return sorted(results)
+
+
+class DedupService:
+    """图片去重索引服务"""
+
+    def __init__(self, index_file: Optional[Path] = None, output_dir: Optional[Path] = None):
+        self.index_file = index_file or settings.DEDUP_INDEX_FILE
+        self.output_dir = output_dir or settings.OUTPUT_DIR
+        self._log = SharedLog(self.index_file)
+        self._records: dict[str, dict] = {}
+        self._by_sha256: dict[str, set[str]] = {}
+        self._tree = BKTree()
+        self._log_lines = 0
+        self._lock = threading.RLock()
+
+    # ===== 持久化 =====
+
+    def _sync(self):
+        """读取日志中新增的记录（包括其他 worker 写入的），日志被重写时重新加载"""
+        reset, entries = self._log.read_new()
+        if reset:
+            self._records.clear()
+            self._by_sha256.clear()
+            self._tree = BKTree()
+            self._log_lines = 0
+        for entry in entries:
+            self._apply(entry)
+        self._log_lines += len(entries)
+
+    def _apply(self, entry: dict):
+        """将一条日志应用到内存索引"""
+        op = entry.get("op")
+        if op == "add":
+            record = {k: entry.get(k) for k in ("filename", "sha256", "dhash", "size", "mtime")}
+            self._remove_record(record["filename"])
+            self._insert_record(record)
+        elif op == "remove":
+            self._remove_record(entry["filename"])
+        elif op == "rename":
+            record = self._remove_record(entry["old"])
+            if record:
+                record["filename"] = entry["new"]
+                self._remove_record(entry["new"])
+                self._insert_record(record)
+
+    def _append(self, entry: dict):
+        """追加一条日志并应用（需持有日志写锁，且已调用 _sync）"""
+        self._log.append([entry])
+        self._apply(entry)
+        self._log_lines += 1
+        # 日志中已删除 / 重命名的记录过多时压缩
+        if self._log_lines > 2 * len(self._records) + 1000:
+            self._compact()
+
+    def _compact(self):
+        """用当前记录重写日志并重建 BK 树（需持有日志写锁）"""
+        self._log.rewrite([{"op": "add", **record} for record in self._records.values()])
+        self._log_lines = len(self._records)
+        # remove / rename 只清空节点上的文件名，重建以丢弃空节点
+        self._tree = BKTree()
+        for record in self._records.values():
+            if record.get("dhash"):
+                self._tree.add(int(record["dhash"], 16), record["filename"])
+
+    # ===== 内存索引 =====
+
+    def _insert_record(self, record: dict):
+        """把记录加入内存索引"""
+        filename = record["filename"]
+        self._records[filename] = record
+        self._by_sha256.setdefault(record["sha256"], set()).add(filename)
+        if record.get("dhash"):
+            self._tree.add(int(record["dhash"], 16), filename)
+
+    def _remove_record(self, filename: str) -> Optional[dict]:
+        """从内存索引中移除记录"""
+        record = self._records.pop(filename, None)
+        if record is None:
+            return None
+        group = self._by_sha256.get(record["sha256"])
+        if group is not None:
+            group.discard(filename)
+            if not group:
+                del self._by_sha256[record["sha256"]]
+        if record.get("dhash"):
+            self._tree.remove(int(record["dhash"], 16), filename)
+        return record
+
+    # ===== 公共接口 =====
+
+    def add(self, filename: str, image_data: Optional[bytes] = None) -> dict:
+        """
+        将图片加入索引（保存图片后调用）
+
+        Args:
+            filename: 输出目录中的文件名
+            image_data: 图片数据，未提供时从文件读取
+
+        Returns:
+            索引结果，duplicate_of 为内容完全相同的已有图片（没有则为 None）
+        """
+        path = self.output_dir / filename
+        if image_data is None:
+            image_data = path.read_bytes()
+        sha256 = hashlib.sha256(image_data).hexdigest()
+        dhash = compute_dhash(image_data)
+        stat = path.stat()
+
+        with self._lock, self._log.lock():
+            self._sync()
+            existing = sorted(self._by_sha256.get(sha256, set()) - {filename})
+            self._append({
+                "op": "add",
+                "filename": filename,
+                "sha256": sha256,
+                "dhash": f"{dhash:016x}" if dhash is not None else None,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime
+            })
+
+        duplicate_of = existing[0] if existing else None
+        if duplicate_of and settings.DEDUP_HARDLINK:
+            self._hardlink(duplicate_of, filename)
+        return {"filename": filename, "sha256": sha256, "duplicate_of": duplicate_of}
+
+    def remove(self, filename: str):
+        """从索引中移除图片"""
+        with self._lock, self._log.lock():
+            self._sync()
+            if filename in self._records:
+                self._append({"op": "remove", "filename": filename})
+
+    def rename(self, old_filename: str, new_filename: str):
+        """图片重命名后同步索引"""
+        with self._lock, self._log.lock():
+            self._sync()
+            if old_filename in self._records:
+                self._append({"op": "rename", "old": old_filename, "new": new_filename})
+
+    def find_similar(self, filename: str, max_distance: int = 8, limit: int = 50) -> Optional[list[dict]]:
+        """
+        查找与指定图片相同或相似的图片
+
+        Args:
+            filename: 图片文件名
+            max_distance: dHash 最大汉明距离
+            limit: 最多返回数量
+
+        Returns:
+            相似图片列表（按距离升序，完全相同的排在最前）；图片未被索引时返回 None
+        """
+        with self._lock:
+            self._sync()
+            record = self._records.get(filename)
+            if record is None:
+                return None
+
+            results: dict[str, dict] = {}
+            for name in self._by_sha256.get(record["sha256"], set()):
+                if name != filename:
+                    results[name] = {"filename": name, "distance": 0, "exact": True}
+            if record.get("dhash"):
+                for distance, name in self._tree.search(int(record["dhash"], 16), max_distance):
+                    if name != filename and name not in results:
+                        results[name] = {"filename": name, "distance": distance, "exact": False}
+
+        ordered = sorted(results.values(), key=lambda r: (not r["exact"], r["distance"], r["filename"]))
+        return ordered[:limit]
+
+    def _hardlink(self, source: str, target: str) -> int:
+        """将 target 替换为指向 source 的硬链接，返回节省的字节数"""
+        source_path = self.output_dir / source
+        target_path = self.output_dir / target
+        try:
+            if os.path.samefile(source_path, target_path):
+                return 0
+            size = target_path.stat().st_size
+            tmp_path = target_path.with_name(f".{target}.link")
+            if tmp_path.exists():
+                tmp_path.unlink()
+            os.link(source_path, tmp_path)
+            os.replace(tmp_path, target_path)
+        except OSError as e:
+            print(f"Hardlink {target} -> {source} failed: {e}")
+            return 0
+
+        # 硬链接后文件的 mtime 随源文件变化，同步到索引，避免下次对账时重复计算
+        stat = target_path.stat()
+        with self._lock, self._log.lock():
+            self._sync()
+            record = self._records.get(target)
+            if record:
+                self._append({**record, "op": "add", "size": stat.st_size, "mtime": stat.st_mtime})
+        return size
+
+    def hardlink_duplicates(self) -> dict:
+        """
+        将所有内容完全相同的图片硬链接到同一份数据
+
+        Returns:
+            linked: 被替换为硬链接的文件数，bytes_saved: 节省的字节数
+        """
+        with self._lock:
+            self._sync()
+            groups = [sorted(names) for names in self._by_sha256.values() if len(names) > 1]
+
+        linked = 0
+        bytes_saved = 0
+        for names in groups:
+            source = names[0]
+            for target in names[1:]:
+                saved = self._hardlink(source, target)
+                if saved:
+                    linked += 1
+                    bytes_saved += saved
+        return {"linked": linked, "bytes_saved": bytes_saved}
+
+    def sync_directory(self) -> dict:
+        """
+        与输出目录对账：索引新增或被修改的图片，移除已不存在的图片
+
+        多个 worker 同时启动时只有拿到对账锁的一个会执行，其余直接跳过（它们会从共享日志读到结果）。
+
+        Returns:
+            added / removed 数量，skipped 表示其他 worker 正在对账
+        """
+        with file_lock(self.index_file.with_name(self.index_file.name + ".sync.lock"), blocking=False) as acquired:
+            if not acquired:
+                return {"added": 0, "removed": 0, "skipped": True}
+
+            on_disk = {}
+            if self.output_dir.exists():
+                with os.scandir(self.output_dir) as entries:
+                    for entry in entries:
+                        if entry.is_file() and entry.name.lower().endswith(".png"):
+                            on_disk[entry.name] = entry.stat()
+
+            with self._lock:
+                self._sync()
+                stale = [name for name in self._records if name not in on_disk]
+                changed = [
+                    name for name, stat in on_disk.items()
+                    if name not in self._records
+                    or self._records[name].get("size") != stat.st_size
+                    or self._records[name].get("mtime") != stat.st_mtime
+                ]
+
+            for name in stale:
+                self.remove(name)
+            added = 0
+            for name in changed:
+                try:
+                    self.add(name)
+                    added += 1
+                except OSError:
+                    continue
+            return {"added": added, "removed": len(stale), "skipped": False}
@@ -0,0 +1,247 @@
+"""图片库索引服务
+
+在内存中维护输出目录的图片列表，每次变更（新增 / 删除 / 重命名）分配递增的版本号，
+前端带上游标（cursor）即可只获取上次之后的变化，不必每次拉取完整列表。
+
+变更写入多个 worker 共享的日志，版本号即日志中的行号，因此游标在各个 worker 之间通用，
+任一 worker 记录的变化都能通过其他 worker 的增量查询拿到。
+"""
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from config import settings
+from services.shared_log import SharedLog
+
+
+def normalize_filename(filename: str) -> Optional[str]:
+    """
+    规范化用户提供的文件名：去掉目录部分，确保 .png 扩展名
+
+    Returns:
+        规范化后的文件名，无效时返回 None
+    """
+    name = Path(filename.strip().replace("\\", "/")).name
+    if not name or name.startswith("."):
+        return None
+    if not name.lower().endswith(".png"):
+        name += ".png"
+    return name
+
+
+def unique_output_path(filename: str, output_dir: Optional[Path] = None) -> Path:
+    """文件名已存在时添加时间戳（必要时再加序号），返回不会覆盖已有文件的路径"""
+    output_dir = output_dir or settings.OUTPUT_DIR
+    path = output_dir / filename
+    if not path.exists():
+        return path
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    name_without_ext = filename.rsplit('.', 1)[0]
+    path = output_dir / f"{name_without_ext}_{timestamp}.png"
+    index = 1
+    while path.exists():
+        path = output_dir / f"{name_without_ext}_{timestamp}_{index}.png"
+        index += 1
+    return path
+
+
+class GalleryService:
+    """图片库索引与增量列表"""
+
+    # 保留的删除记录数量，超过后更早的游标需要重新拉取完整列表
+    MAX_TOMBSTONES = 10000
+
+    def __init__(self, output_dir: Optional[Path] = None, log_file: Optional[Path] = None):
+        self.output_dir = output_dir or settings.OUTPUT_DIR
+        # 日志标识（log_id）写在游标里，日志重建（压缩）后旧游标失效
+        self._log = SharedLog(log_file or settings.GALLERY_LOG_FILE)
+        # 已应用的日志行数，即当前版本号
+        self._version = 0
+        # filename -> (created_at, mtime, version)，按版本号顺序插入，增量查询时可从尾部倒序遍历
+        # created_at 为展示用的创建时间，mtime 为记录时的文件修改时间，用于发现外部修改
+        # （两者通常相同；去重硬链接后文件 mtime 变为源文件的 mtime，created_at 仍为保存时间）
+        self._images: dict[str, tuple[float, float, int]] = {}
+        # filename -> 删除时的版本号（同样按版本号顺序）
+        self._removed: dict[str, int] = {}
+        # 早于该版本的游标无法给出完整的删除记录
+        self._min_version = 0
+        self._lock = threading.Lock()
+
+    # ===== 共享日志 =====
+
+    def _sync(self):
+        """应用日志中新增的变更（包括其他 worker 写入的），日志被重建时从头重放"""
+        reset, entries = self._log.read_new()
+        if reset:
+            self._clear()
+        for entry in entries:
+            self._apply(entry)
+
+    def _clear(self):
+        self._version = 0
+        self._images.clear()
+        self._removed.clear()
+        self._min_version = 0
+
+    def _apply(self, entry: dict):
+        """将一条日志应用到内存状态，每条日志占一个版本号"""
+        self._version += 1
+        op = entry.get("op")
+        if op == "set":
+            self._set(entry["filename"], entry["created_at"], entry.get("mtime", entry["created_at"]))
+        elif op == "remove":
+            self._delete(entry["filename"])
+
+    def _write(self, entries: list[dict]):
+        """追加变更并应用（需持有日志写锁，且已调用 _sync）"""
+        # 没有变化时也要确保日志已创建，游标中才有 log_id
+        if not entries and self._log.log_id is not None:
+            return
+        self._log.append(entries)
+        for entry in entries:
+            self._apply(entry)
+        # 日志远大于当前图片数时重建，重建后所有客户端重新拉取一次完整列表
+        if self._version - self._min_version > 4 * len(self._images) + self.MAX_TOMBSTONES:
+            self._compact()
+
+    def _compact(self):
+        """用当前图片列表重建日志（需持有日志写锁）"""
+        entries = [
+            {"op": "set", "filename": filename, "created_at": created_at, "mtime": mtime}
+            for filename, (created_at, mtime, _) in self._images.items()
+        ]
+        self._log.rewrite(entries)
+        self._clear()
+        for entry in entries:
+            self._apply(entry)
+
+    # ===== 内存状态 =====
+
+    def _set(self, filename: str, created_at: float, mtime: float):
+        self._images.pop(filename, None)
+        self._images[filename] = (created_at, mtime, self._version)
+        self._removed.pop(filename, None)
+
+    def _delete(self, filename: str):
+        if self._images.pop(filename, None) is None:
+            return
+        self._removed.pop(filename, None)
+        self._removed[filename] = self._version
+        if len(self._removed) > self.MAX_TOMBSTONES:
+            # 丢弃最早的删除记录（dict 保持插入顺序）
+            oldest = next(iter(self._removed))
+            self._min_version = self._removed.pop(oldest)
+
+    # ===== 公共接口 =====
+
+    def refresh(self):
+        """扫描输出目录，同步外部产生的变化"""
+        on_disk = {}
+        if self.output_dir.exists():
+            with os.scandir(self.output_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith(".png"):
+                        on_disk[entry.name] = entry.stat().st_mtime
+
+        with self._lock, self._log.lock():
+            self._sync()
+            changes = [
+                {"op": "remove", "filename": filename}
+                for filename in self._images if filename not in on_disk
+            ]
+            for filename, mtime in on_disk.items():
+                current = self._images.get(filename)
+                if current is None or current[1] != mtime:
+                    changes.append({"op": "set", "filename": filename, "created_at": mtime, "mtime": mtime})
+            self._write(changes)
+
+    def record(self, filename: str, created_at: Optional[float] = None):
+        """
+        记录新保存的图片
+
+        Args:
+            filename: 文件名
+            created_at: 保存时间，默认取文件 mtime（文件被替换为硬链接后 mtime 不再是保存时间）
+        """
+        path = self.output_dir / filename
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            return
+        entry = {"op": "set", "filename": filename, "created_at": created_at or mtime, "mtime": mtime}
+        with self._lock, self._log.lock():
+            self._sync()
+            self._write([entry])
+
+    def rename(self, old_filename: str, new_filename: str):
+        """记录图片重命名"""
+        with self._lock, self._log.lock():
+            self._sync()
+            current = self._images.get(old_filename)
+            if current is None:
+                return
+            self._write([
+                {"op": "remove", "filename": old_filename},
+                {"op": "set", "filename": new_filename, "created_at": current[0], "mtime": current[1]}
+            ])
+
+    def _parse_cursor(self, cursor: Optional[str]) -> Optional[int]:
+        """解析游标，无效或已过期时返回 None"""
+        if not cursor:
+            return None
+        log_id, _, version = cursor.partition(":")
+        if self._log.log_id is None or log_id != self._log.log_id or not version.isdigit():
+            return None
+        version = int(version)
+        if version < self._min_version or version > self._version:
+            return None
+        return version
+
+    def list_images(self, since: Optional[str] = None) -> dict:
+        """
+        获取图片列表
+
+        Args:
+            since: 上次返回的游标；为空或失效时返回完整列表（reset 为 True）
+
+        Returns:
+            images: 新增或变化的图片，removed: 被删除的文件名，cursor: 新游标，reset: 是否为完整列表
+        """
+        with self._lock:
+            self._sync()
+            version = self._parse_cursor(since)
+        if version is None:
+            # 完整列表时重新扫描目录，纳入外部变化
+            self.refresh()
+
+        with self._lock:
+            reset = version is None
+            if reset:
+                version = 0
+            images = []
+            for filename, (created_at, _, changed) in reversed(self._images.items()):
+                if changed <= version:
+                    break
+                images.append({
+                    "filename": filename,
+                    "url": f"/api/images/{filename}",
+                    "created_at": created_at
+                })
+            removed = []
+            if not reset:
+                for filename, changed in reversed(self._removed.items()):
+                    if changed <= version:
+                        break
+                    removed.append(filename)
+            cursor = f"{self._log.log_id}:{self._version}"
+
+        images.sort(key=lambda img: img["filename"])
+        return {
+            "images": images,
+            "removed": removed,
+            "cursor": cursor,
+            "reset": reset
+        }
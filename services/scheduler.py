@@ -0,0 +1,300 @@
+"""图片生成调度服务
+
+在 GeminiImageGenerator 前面加一层调度：
+- 优先级分类：交互式（单张生成）严格优先于批量任务，批量任务最多占用部分并发槽位
+- 同一优先级内按客户端做加权公平排队（WFQ），避免单个大批量请求独占
+- 队列满时拒绝新任务（准入控制），由 API 层返回 429 + Retry-After
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Awaitable, Callable, Optional
+
+
+class Priority(str, Enum):
+    """任务优先级"""
+    INTERACTIVE = "interactive"
+    BULK = "bulk"
+
+
+class QueueFullError(Exception):
+    """队列已满，任务未被接纳"""
+
+    def __init__(self, priority: Priority, retry_after: int):
+        self.priority = priority
+        self.retry_after = retry_after
+        super().__init__(f"{priority.value} 队列已满，请 {retry_after} 秒后重试")
+
+
+@dataclass(order=True)
+class _Job:
+    """排队中的任务（按虚拟完成时间排序）"""
+    finish_tag: float
+    seq: int
+    start_tag: float = field(compare=False)
+    client_id: str = field(compare=False)
+    func: Callable[[], Awaitable[Any]] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    dispatched: bool = field(default=False, compare=False)
+
+
+class _ClassStats:
+    """单个优先级的运行指标"""
+
+    def __init__(self, window: int = 1000):
+        self.admitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.wait_times: deque[float] = deque(maxlen=window)
+
+    def wait_percentile(self, pct: float) -> float:
+        """等待时间分位数（秒）"""
+        if not self.wait_times:
+            return 0.0
+        ordered = sorted(self.wait_times)
+        index = min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1)
+        return ordered[max(index, 0)]
+
+
+class GenerationScheduler:
+    """带优先级与加权公平排队的生成任务调度器"""
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        bulk_max_concurrency: Optional[int] = None,
+        queue_limits: Optional[dict[Priority, int]] = None,
+        client_queue_limits: Optional[dict[Priority, int]] = None,
+        client_weights: Optional[dict[str, float]] = None
+    ):
+        """
+        初始化调度器
+
+        Args:
+            max_concurrency: 同时执行的生成任务总数
+            bulk_max_concurrency: 批量任务最多占用的槽位数（默认为总数减一，给交互式请求留余量）
+            queue_limits: 每个优先级的最大排队数
+            client_queue_limits: 每个优先级下单个客户端的最大排队数（未配置则不限制）
+            client_weights: 客户端权重，未配置的客户端权重为 1
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        if bulk_max_concurrency is None:
+            bulk_max_concurrency = self.max_concurrency - 1
+        self.bulk_max_concurrency = min(max(1, bulk_max_concurrency), self.max_concurrency)
+        self.queue_limits = {Priority.INTERACTIVE: 32, Priority.BULK: 200}
+        if queue_limits:
+            self.queue_limits.update(queue_limits)
+        self.client_queue_limits = client_queue_limits or {}
+        self.client_weights = client_weights or {}
+
+        self._queues: dict[Priority, list[_Job]] = {p: [] for p in Priority}
+        self._virtual_time: dict[Priority, float] = {p: 0.0 for p in Priority}
+        self._last_finish: dict[tuple[Priority, str], float] = {}
+        self._running: dict[Priority, int] = {p: 0 for p in Priority}
+        # 仍在排队（未取消、未开始执行）的任务数，用于准入控制和指标
+        self._queued: dict[Priority, int] = {p: 0 for p in Priority}
+        self._client_queued: dict[tuple[Priority, str], int] = {}
+        self._stats: dict[Priority, _ClassStats] = {p: _ClassStats() for p in Priority}
+        self._service_times: deque[float] = deque(maxlen=200)
+        self._seq = itertools.count()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def run(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        client_id: str,
+        priority: Priority = Priority.INTERACTIVE
+    ) -> Any:
+        """提交单个任务并等待结果"""
+        return await self.submit_many([func], client_id, priority)[0]
+
+    def submit_many(
+        self,
+        funcs: list[Callable[[], Awaitable[Any]]],
+        client_id: str,
+        priority: Priority = Priority.BULK
+    ) -> list[asyncio.Future]:
+        """
+        一次性提交多个任务（全部接纳或全部拒绝）
+
+        Args:
+            funcs: 返回协程的可调用对象列表
+            client_id: 客户端标识（API token 或 IP）
+            priority: 任务优先级
+
+        Returns:
+            与 funcs 一一对应的 Future 列表
+
+        Raises:
+            QueueFullError: 队列（或该客户端的排队配额）剩余容量不足
+        """
+        queue = self._queues[priority]
+        stats = self._stats[priority]
+        key = (priority, client_id)
+        client_limit = self.client_queue_limits.get(priority)
+        if (
+            self._queued[priority] + len(funcs) > self.queue_limits[priority]
+            or (client_limit is not None and self._client_queued.get(key, 0) + len(funcs) > client_limit)
+        ):
+            stats.rejected += len(funcs)
+            raise QueueFullError(priority, self._estimate_retry_after(priority))
+
+        loop = asyncio.get_running_loop()
+        weight = max(self.client_weights.get(client_id, 1.0), 0.01)
+        futures = []
+        for func in funcs:
+            # 虚拟完成时间 = max(当前虚拟时间, 该客户端上个任务的完成时间) + 代价 / 权重
+            start_tag = max(self._virtual_time[priority], self._last_finish.get(key, 0.0))
+            finish_tag = start_tag + 1.0 / weight
+            self._last_finish[key] = finish_tag
+
+            future = loop.create_future()
+            job = _Job(
+                finish_tag=finish_tag,
+                seq=next(self._seq),
+                start_tag=start_tag,
+                client_id=client_id,
+                func=func,
+                future=future,
+                enqueued_at=time.monotonic()
+            )
+            # 排队期间被取消（如客户端断开）时立即归还排队名额
+            future.add_done_callback(lambda f, job=job, priority=priority: self._on_cancelled(priority, job))
+            heapq.heappush(queue, job)
+            futures.append(future)
+
+        self._queued[priority] += len(funcs)
+        self._client_queued[key] = self._client_queued.get(key, 0) + len(funcs)
+        stats.admitted += len(funcs)
+        self._dispatch()
+        return futures
+
+    def capacity(self, priority: Priority) -> int:
+        """单次提交最多可接纳的任务数（超过时无论等待多久都无法入队）"""
+        client_limit = self.client_queue_limits.get(priority)
+        if client_limit is None:
+            return self.queue_limits[priority]
+        return min(self.queue_limits[priority], client_limit)
+
+    def _release(self, priority: Priority, job: _Job):
+        """任务离开队列（开始执行或被取消）时扣减排队计数"""
+        self._queued[priority] -= 1
+        key = (priority, job.client_id)
+        remaining = self._client_queued.get(key, 0) - 1
+        if remaining > 0:
+            self._client_queued[key] = remaining
+        else:
+            self._client_queued.pop(key, None)
+
+    def _on_cancelled(self, priority: Priority, job: _Job):
+        """Future 完成回调：只处理排队期间被取消的任务"""
+        if job.dispatched:
+            return
+        # 标记为已处理，避免重复扣减
+        job.dispatched = True
+        self._release(priority, job)
+        self._stats[priority].cancelled += 1
+
+    def _can_start(self, priority: Priority) -> bool:
+        """判断该优先级当前是否可以占用新槽位"""
+        if sum(self._running.values()) >= self.max_concurrency:
+            return False
+        if priority is Priority.BULK:
+            return self._running[Priority.BULK] < self.bulk_max_concurrency
+        return True
+
+    def _next_job(self) -> Optional[tuple[Priority, _Job]]:
+        """按优先级取出下一个可执行的任务，跳过已被取消的任务"""
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and queue[0].future.done():
+                heapq.heappop(queue)
+            if queue and self._can_start(priority):
+                return priority, heapq.heappop(queue)
+        return None
+
+    def _dispatch(self):
+        """尽可能多地启动排队任务"""
+        while True:
+            picked = self._next_job()
+            if picked is None:
+                break
+            priority, job = picked
+            job.dispatched = True
+            self._release(priority, job)
+            self._virtual_time[priority] = max(self._virtual_time[priority], job.start_tag)
+            if not self._queues[priority]:
+                # 队列清空后重置虚拟时钟，防止客户端记录无限增长
+                self._virtual_time[priority] = 0.0
+                self._last_finish = {k: v for k, v in self._last_finish.items() if k[0] is not priority}
+            self._running[priority] += 1
+            self._stats[priority].wait_times.append(time.monotonic() - job.enqueued_at)
+            task = asyncio.ensure_future(self._execute(priority, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, priority: Priority, job: _Job):
+        """执行任务并把结果回传给提交方"""
+        started = time.monotonic()
+        try:
+            result = await job.func()
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._service_times.append(time.monotonic() - started)
+            self._running[priority] -= 1
+            self._stats[priority].completed += 1
+            self._dispatch()
+
+    def _estimate_retry_after(self, priority: Priority) -> int:
+        """根据排队长度和平均执行时长估算重试等待秒数"""
+        avg_service = (
+            sum(self._service_times) / len(self._service_times)
+            if self._service_times else 10.0
+        )
+        slots = self.max_concurrency if priority is Priority.INTERACTIVE else self.bulk_max_concurrency
+        backlog = self._queued[priority] + self._running[priority]
+        return max(1, math.ceil(backlog / slots * avg_service))
+
+    def get_stats(self) -> dict:
+        """
+        获取调度指标
+
+        Returns:
+            各优先级的排队深度、运行数、等待时间等
+        """
+        classes = {}
+        for priority in Priority:
+            stats = self._stats[priority]
+            waits = stats.wait_times
+            classes[priority.value] = {
+                "queue_depth": self._queued[priority],
+                "queue_limit": self.queue_limits[priority],
+                "client_queue_limit": self.client_queue_limits.get(priority),
+                "queued_clients": sum(1 for key in self._client_queued if key[0] is priority),
+                "running": self._running[priority],
+                "admitted": stats.admitted,
+                "rejected": stats.rejected,
+                "completed": stats.completed,
+                "cancelled": stats.cancelled,
+                "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+                "wait_p50": stats.wait_percentile(50),
+                "wait_p95": stats.wait_percentile(95),
+                "wait_max": max(waits) if waits else 0.0
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "bulk_max_concurrency": self.bulk_max_concurrency,
+            "classes": classes
+        }
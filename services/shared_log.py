@@ -0,0 +1,157 @@
+"""多进程共享的追加写 JSONL 日志
+
+多个 uvicorn worker 各自在内存中维护索引，通过同一个日志文件同步变化：
+- 写入（追加 / 压缩重写）在文件锁内进行，不会丢失其他 worker 追加的行
+- 读取只消费上次读取位置之后的完整行；日志被其他 worker 压缩重写（log_id 变化）后从头重新读取
+"""
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 flock，只能单 worker 运行
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path: Path, exclusive: bool = True, blocking: bool = True) -> Iterator[bool]:
+    """
+    基于 flock 的跨进程文件锁
+
+    Args:
+        path: 锁文件路径（不存在时自动创建）
+        exclusive: 排他锁或共享锁
+        blocking: 为 False 时拿不到锁立即返回
+
+    Yields:
+        是否拿到了锁
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as f:
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(f.fileno(), flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class SharedLog:
+    """
+    记录读取位置的共享 JSONL 日志（本身不是线程安全的，调用方需自行加线程锁）
+
+    日志第一行是带随机 log_id 的头部，压缩重写时生成新的 log_id，读取方据此发现日志已被替换。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock_path = path.with_name(path.name + ".lock")
+        self._offset = 0
+        self._log_id: Optional[str] = None
+
+    @property
+    def log_id(self) -> Optional[str]:
+        """当前日志的标识，日志尚未创建时为 None"""
+        return self._log_id
+
+    def lock(self, exclusive: bool = True):
+        """日志写锁；同一进程内不要嵌套获取"""
+        return file_lock(self.lock_path, exclusive=exclusive)
+
+    @staticmethod
+    def _header(log_id: str) -> str:
+        return json.dumps({"log_id": log_id}) + "\n"
+
+    def read_new(self) -> tuple[bool, list[dict]]:
+        """
+        读取上次之后新增的日志
+
+        Returns:
+            (reset, entries)：reset 为 True 表示日志已被重写，entries 为完整日志，调用方需清空内存状态后重放
+        """
+        try:
+            f = self.path.open("rb")
+        except FileNotFoundError:
+            f = None
+        if f is None:
+            reset = self._log_id is not None
+            self._offset = 0
+            self._log_id = None
+            return reset, []
+
+        with f:
+            header = f.readline()
+            if not header.endswith(b"\n"):
+                # 空文件，或头部还没写完
+                return False, []
+            try:
+                log_id = json.loads(header)["log_id"]
+                body_start = len(header)
+            except (ValueError, TypeError, KeyError):
+                # 没有头部的旧日志，第一行就是记录
+                log_id = ""
+                body_start = 0
+
+            reset = False
+            size = os.fstat(f.fileno()).st_size
+            if log_id != self._log_id or size < self._offset:
+                reset = self._log_id is not None
+                self._log_id = log_id
+                self._offset = body_start
+            f.seek(self._offset)
+            data = f.read()
+
+        # 只消费完整的行，写了一半的行留到下次读取
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        entries = []
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return reset, entries
+
+    def append(self, entries: list[dict]):
+        """追加日志，日志不存在时先写入头部（需持有写锁，且已通过 read_new 读到末尾）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        with self.path.open("a", encoding="utf-8") as f:
+            if f.tell() == 0:
+                self._log_id = uuid.uuid4().hex[:8]
+                data = self._header(self._log_id) + data
+            f.write(data)
+            f.flush()
+            self._offset = f.tell()
+
+    def rewrite(self, entries: list[dict]):
+        """用给定内容原子替换整个日志，并生成新的 log_id（需持有写锁）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        log_id = uuid.uuid4().hex[:8]
+        tmp_file = self.path.with_name(self.path.name + ".tmp")
+        with tmp_file.open("w", encoding="utf-8") as f:
+            f.write(self._header(log_id))
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            offset = f.tell()
+        os.replace(tmp_file, self.path)
+        self._log_id = log_id
+        self._offset = offset
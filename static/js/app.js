@@ -15,7 +15,16 @@ const state = {
     // 图片缩放状态
     currentImageZoom: 100,
     minZoom: 50,
-    maxZoom: 200
+    maxZoom: 200,
+    // 图库状态（增量同步 + 虚拟滚动）
+    gallery: {
+        cursor: null,          // 服务端返回的增量游标
+        images: new Map(),     // filename -> 图片信息
+        order: [],             // 排序后的文件名（最新在前）
+        nodes: new Map(),      // filename -> 已创建的 DOM 节点
+        range: null,           // 当前渲染的行范围
+        loading: false
+    }
 };
 
 // DOM 加载完成后初始化
@@ -31,6 +40,7 @@ document.addEventListener('DOMContentLoaded', () => {
     initBatchForm();
     initLightbox();
     initRefreshButton();
+    initGalleryVirtualScroll();
     initSaveTemplateButton();
     initUserTemplates();
     initImageZoom();
@@ -559,6 +569,9 @@ function initSingleForm() {
             return;
         }
 
+        // 先确定文件名，随生成请求一起提交，省去生成后的重命名请求
+        const filename = await new Promise(resolve => showFilenameDialog(null, resolve));
+
         setLoading(submitBtn, true);
 
         // 显示生成进度
@@ -596,7 +609,8 @@ function initSingleForm() {
             const requestBody = {
                 prompt: finalPrompt,
                 text_content: textContent || null,
-                aspect_ratio: aspectRatio
+                aspect_ratio: aspectRatio,
+                filename: filename
             };
 
             // 如果有参考图片，添加到请求中
@@ -612,93 +626,76 @@ function initSingleForm() {
 
             const data = await response.json();
 
+            // 队列已满（429）等错误
+            if (!response.ok) {
+                resultDiv.innerHTML = '';
+                showToast(`请求失败: ${data.detail || response.status}`, 'error');
+                return;
+            }
+
             if (data.success) {
                 // 完成进度条
                 if (progressFill) {
                     progressFill.style.width = '100%';
                 }
 
-                // 显示文件命名对话框
-                showFilenameDialog(data.filename, async (finalFilename) => {
-                    // 如果文件名需要改变，调用重命名 API
-                    if (finalFilename !== data.filename) {
-                        try {
-                            const renameResponse = await fetch('/api/rename', {
-                                method: 'POST',
-                                headers: { 'Content-Type': 'application/json' },
-                                body: JSON.stringify({
-                                    old_filename: data.filename,
-                                    new_filename: finalFilename
-                                })
-                            });
-
-                            const renameData = await renameResponse.json();
-
-                            if (renameData.success) {
-                                // 更新显示的文件名和 URL
-                                data.filename = finalFilename;
-                                data.url = renameData.url;
-                            } else {
-                                showToast(`重命名失败: ${renameData.error}`, 'error');
-                            }
-                        } catch (error) {
-                            showToast(`重命名失败: ${error.message}`, 'error');
-                        }
-                    }
-
-                    // 显示结果（带缩放控制）
-                    const imageId = 'generated-img-' + Date.now();
-                    resultDiv.innerHTML = `
-                        <div class="result-image">
-                            <div class="result-image-container" id="${imageId}-container">
-                                <img id="${imageId}" data-result-image="${imageId}" src="${data.url}" alt="${escapeHtml(finalPrompt)}">
-                                <div class="image-zoom-controls">
-                                    <button class="zoom-btn zoom-out" data-image-id="${imageId}" title="缩小">
-                                        <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
-                                            <circle cx="11" cy="11" r="8"/>
-                                            <path d="M21 21l-4.35-4.35"/>
-                                            <path d="M8 11h6"/>
-                                        </svg>
-                                    </button>
-                                    <span class="zoom-level" id="${imageId}-level">100%</span>
-                                    <button class="zoom-btn zoom-in" data-image-id="${imageId}" title="放大">
-                                        <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
-                                            <circle cx="11" cy="11" r="8"/>
-                                            <path d="M21 21l-4.35-4.35"/>
-                                            <path d="M11 8v6M8 11h6"/>
-                                        </svg>
-                                    </button>
-                                    <button class="zoom-btn zoom-reset" data-image-id="${imageId}" title="重置">
-                                        <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
-                                            <path d="M3 12a9 9 0 1 0 9-9 9.75 9.75 0 0 0-6.74 2.74L3 8"/>
-                                            <path d="M3 3v5h5"/>
-                                        </svg>
-                                    </button>
-                                </div>
+                // 增量同步图库
+                if (state.gallery.cursor) {
+                    loadHistory();
+                }
+
+                // 显示结果（带缩放控制）
+                const imageId = 'generated-img-' + Date.now();
+                resultDiv.innerHTML = `
+                    <div class="result-image">
+                        <div class="result-image-container" id="${imageId}-container">
+                            <img id="${imageId}" data-result-image="${imageId}" src="${data.url}" alt="${escapeHtml(finalPrompt)}">
+                            <div class="image-zoom-controls">
+                                <button class="zoom-btn zoom-out" data-image-id="${imageId}" title="缩小">
+                                    <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
+                                        <circle cx="11" cy="11" r="8"/>
+                                        <path d="M21 21l-4.35-4.35"/>
+                                        <path d="M8 11h6"/>
+                                    </svg>
+                                </button>
+                                <span class="zoom-level" id="${imageId}-level">100%</span>
+                                <button class="zoom-btn zoom-in" data-image-id="${imageId}" title="放大">
+                                    <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
+                                        <circle cx="11" cy="11" r="8"/>
+                                        <path d="M21 21l-4.35-4.35"/>
+                                        <path d="M11 8v6M8 11h6"/>
+                                    </svg>
+                                </button>
+                                <button class="zoom-btn zoom-reset" data-image-id="${imageId}" title="重置">
+                                    <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
+                                        <path d="M3 12a9 9 0 1 0 9-9 9.75 9.75 0 0 0-6.74 2.74L3 8"/>
+                                        <path d="M3 3v5h5"/>
+                                    </svg>
+                                </button>
                             </div>
                         </div>
-                        <div class="result-actions">
-                            <button class="btn btn-secondary" onclick="openLightbox('${data.url}', '${escapeHtml(finalPrompt)}')">
-                                <svg width="18" height="18" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
-                                    <path d="M15 3h6v6M9 21H3v-6M21 3l-7 7M3 21l7-7"/>
-                                </svg>
-                                查看大图
-                            </button>
-                            <button class="btn btn-secondary" onclick="downloadImage('${data.url}', '${data.filename}')">
-                                <svg width="18" height="18" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
-                                    <path d="M21 15v4a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2v-4"/>
-                                    <path d="M7 10l5 5 5-5"/>
-                                    <path d="M12 15V3"/>
-                                </svg>
-                                下载
-                            </button>
-                        </div>
-                    `;
+                    </div>
+                    <div class="result-actions">
+                        <button class="btn btn-secondary" onclick="openLightbox('${data.url}', '${escapeHtml(finalPrompt)}')">
+                            <svg width="18" height="18" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
+                                <path d="M15 3h6v6M9 21H3v-6M21 3l-7 7M3 21l7-7"/>
+                            </svg>
+                            查看大图
+                        </button>
+                        <button class="btn btn-secondary" onclick="downloadImage('${data.url}', '${data.filename}')">
+                            <svg width="18" height="18" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2">
+                                <path d="M21 15v4a2 2 0 0 1-2 2H5a2 2 0 0 1-2-2v-4"/>
+                                <path d="M7 10l5 5 5-5"/>
+                                <path d="M12 15V3"/>
+                            </svg>
+                            下载
+                        </button>
+                    </div>
+                `;
 
-                    // 初始化该图片的缩放功能
-                    initImageZoomControls(imageId);
-                    showToast('图片生成成功！', 'success');
-                });
+                // 初始化该图片的缩放功能
+                initImageZoomControls(imageId);
+                showToast('图片生成成功！', 'success');
             } else {
                 resultDiv.innerHTML = '';
                 showToast(`生成失败: ${data.error}`, 'error');
@@ -760,6 +757,13 @@ function initBatchForm() {
 
             const data = await response.json();
 
+            // 队列已满（429）等错误
+            if (!response.ok) {
+                resultDiv.innerHTML = '';
+                showToast(`请求失败: ${data.detail || response.status}`, 'error');
+                return;
+            }
+
             let html = '<div class="batch-results">';
             data.results.forEach((result) => {
                 if (result.success) {
@@ -782,6 +786,11 @@ function initBatchForm() {
 
             resultDiv.innerHTML = html;
 
+            // 增量同步图库
+            if (data.succeeded > 0 && state.gallery.cursor) {
+                loadHistory();
+            }
+
             if (data.failed === 0) {
                 showToast(`批量生成完成！成功: ${data.succeeded}`, 'success');
             } else {
@@ -796,33 +805,173 @@ function initBatchForm() {
     });
 }
 
-// 加载历史记录
-async function loadHistory() {
+// 加载历史记录（已加载过时只拉取增量，full 为 true 时重新拉取完整列表）
+async function loadHistory(full = false) {
     const historyList = document.getElementById('history-list');
-    historyList.innerHTML = '<div class="empty-state loading-pulse">加载中...</div>';
+    const gallery = state.gallery;
+    if (gallery.loading) return;
+    gallery.loading = true;
+
+    if (gallery.order.length === 0) {
+        historyList.innerHTML = '<div class="empty-state loading-pulse">加载中...</div>';
+    } else {
+        // 先显示已缓存的图片，增量返回后再补丁
+        renderGallery(true);
+    }
 
     try {
-        const response = await fetch('/api/images');
+        const query = (!full && gallery.cursor) ? `?since=${encodeURIComponent(gallery.cursor)}` : '';
+        const response = await fetch(`/api/images${query}`);
         const data = await response.json();
 
-        if (data.images.length === 0) {
-            historyList.innerHTML = '<div class="empty-state">暂无生成的图片<br><small>快去生成你的第一张图片吧！</small></div>';
-            return;
+        applyGalleryDelta(data);
+        renderGallery(true);
+    } catch (error) {
+        if (gallery.order.length === 0) {
+            historyList.innerHTML = `<div class="empty-state">加载失败: ${escapeHtml(error.message)}</div>`;
+        } else {
+            showToast(`加载失败: ${error.message}`, 'error');
         }
+    } finally {
+        gallery.loading = false;
+    }
+}
 
-        let html = '';
-        data.images.reverse().forEach(img => {
-            html += `
-                <div class="history-item" onclick="openLightbox('${img.url}', '历史图片')">
-                    <img src="${img.url}" alt="${img.filename}" loading="lazy">
-                    <div class="filename">${img.filename}</div>
-                </div>
-            `;
-        });
-        historyList.innerHTML = html;
-    } catch (error) {
-        historyList.innerHTML = `<div class="empty-state">加载失败: ${error.message}</div>`;
+// 应用服务端返回的增量（或完整）列表
+function applyGalleryDelta(data) {
+    const gallery = state.gallery;
+
+    if (data.reset) {
+        gallery.images.clear();
+        gallery.nodes.clear();
+    }
+
+    (data.removed || []).forEach(filename => {
+        gallery.images.delete(filename);
+        gallery.nodes.delete(filename);
+    });
+
+    data.images.forEach(img => {
+        const existing = gallery.images.get(img.filename);
+        // 同名文件内容变化时重新创建节点
+        if (existing && existing.created_at !== img.created_at) {
+            gallery.nodes.delete(img.filename);
+        }
+        gallery.images.set(img.filename, img);
+    });
+
+    gallery.cursor = data.cursor;
+    gallery.order = Array.from(gallery.images.values())
+        .sort((a, b) => b.created_at - a.created_at || a.filename.localeCompare(b.filename))
+        .map(img => img.filename);
+}
+
+// 获取（或创建）图库条目节点，节点在滚动时复用
+function getGalleryNode(filename) {
+    const gallery = state.gallery;
+    let node = gallery.nodes.get(filename);
+    if (node) return node;
+
+    const img = gallery.images.get(filename);
+    const url = `/api/images/${encodeURIComponent(img.filename)}`;
+
+    node = document.createElement('div');
+    node.className = 'history-item';
+
+    const image = document.createElement('img');
+    // 附带时间戳，同名文件被替换后不会命中旧缓存
+    image.src = `${url}?v=${Math.floor(img.created_at)}`;
+    image.alt = img.filename;
+    image.loading = 'lazy';
+    image.decoding = 'async';
+
+    const name = document.createElement('div');
+    name.className = 'filename';
+    name.textContent = img.filename;
+
+    node.append(image, name);
+    node.addEventListener('click', () => openLightbox(url, '历史图片'));
+
+    gallery.nodes.set(filename, node);
+    return node;
+}
+
+// 测量网格列数和行高
+function measureGalleryLayout(historyList) {
+    let sample = historyList.querySelector('.history-item');
+    if (!sample) {
+        sample = getGalleryNode(state.gallery.order[0]);
+        historyList.replaceChildren(sample);
+    }
+
+    const styles = getComputedStyle(historyList);
+    const columns = Math.max(1, styles.gridTemplateColumns.split(' ').filter(Boolean).length);
+    const rowGap = parseFloat(styles.rowGap) || 0;
+    return { columns, rowHeight: Math.max(1, sample.offsetHeight + rowGap) };
+}
+
+// 虚拟滚动渲染：只渲染可视区域附近的行，上下用 padding 占位
+function renderGallery(force = false) {
+    const historyList = document.getElementById('history-list');
+    const gallery = state.gallery;
+
+    // 历史标签未显示时不渲染，切换过来时再渲染
+    if (!historyList || historyList.offsetParent === null) {
+        gallery.range = null;
+        return;
+    }
+
+    if (gallery.order.length === 0) {
+        gallery.range = null;
+        historyList.style.paddingTop = '';
+        historyList.style.paddingBottom = '';
+        historyList.innerHTML = '<div class="empty-state">暂无生成的图片<br><small>快去生成你的第一张图片吧！</small></div>';
+        return;
     }
+
+    const { columns, rowHeight } = measureGalleryLayout(historyList);
+    const totalRows = Math.ceil(gallery.order.length / columns);
+    const listTop = historyList.getBoundingClientRect().top + window.scrollY;
+    const viewTop = window.scrollY - listTop;
+    const bufferRows = 2;
+
+    const lastRow = Math.min(totalRows - 1, Math.ceil((viewTop + window.innerHeight) / rowHeight) + bufferRows);
+    const firstRow = Math.min(lastRow, Math.max(0, Math.floor(viewTop / rowHeight) - bufferRows));
+    const range = `${firstRow}:${lastRow}:${columns}`;
+    if (!force && gallery.range === range) return;
+    gallery.range = range;
+
+    const visible = gallery.order
+        .slice(firstRow * columns, (lastRow + 1) * columns)
+        .map(getGalleryNode);
+
+    historyList.style.paddingTop = `${firstRow * rowHeight}px`;
+    historyList.style.paddingBottom = `${(totalRows - lastRow - 1) * rowHeight}px`;
+    historyList.replaceChildren(...visible);
+
+    // 限制节点缓存大小，只保留当前渲染的节点
+    if (gallery.nodes.size > 1000) {
+        gallery.nodes = new Map(visible.map((node, i) => [gallery.order[firstRow * columns + i], node]));
+    }
+}
+
+// 初始化图库虚拟滚动
+function initGalleryVirtualScroll() {
+    let scheduled = false;
+    const scheduleRender = () => {
+        if (scheduled) return;
+        scheduled = true;
+        requestAnimationFrame(() => {
+            scheduled = false;
+            renderGallery();
+        });
+    };
+
+    window.addEventListener('scroll', scheduleRender, { passive: true });
+    window.addEventListener('resize', () => {
+        state.gallery.range = null;
+        scheduleRender();
+    });
 }
 
 // 初始化刷新按钮
@@ -830,7 +979,7 @@ function initRefreshButton() {
     const refreshBtn = document.getElementById('refresh-btn');
     if (refreshBtn) {
         refreshBtn.addEventListener('click', () => {
-            loadHistory();
+            loadHistory(true);
             showToast('已刷新', 'success');
         });
     }
@@ -0,0 +1,75 @@
+"""测试共用的 Gemini 替身"""
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from config import settings
+from generators.gemini import GeminiImageGenerator
+from generators.resilience import CircuitBreaker
+
+
+class FakeTypes:
+    """google.genai.types 的最小替身"""
+
+    class Part:
+        def __init__(self, text=None):
+            self.text = text
+
+        @staticmethod
+        def from_bytes(data, mime_type):
+            return SimpleNamespace(data=data, mime_type=mime_type)
+
+    class GenerateContentConfig:
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+
+    class HttpOptions:
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+
+
+def image_response(data=b"\x89PNG fake image"):
+    """返回一张图片的上游响应"""
+    part = SimpleNamespace(inline_data=SimpleNamespace(data=data))
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+class FakeClient:
+    """按顺序执行预设行为的上游客户端，behaviors 中每项是接收调用序号的函数"""
+
+    def __init__(self, *behaviors):
+        self.behaviors = list(behaviors)
+        self.calls = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+        self.models = SimpleNamespace(generate_content=self._generate_content)
+
+    def _generate_content(self, model, contents, config):
+        with self._lock:
+            index = self.calls
+            self.calls += 1
+        behavior = self.behaviors[min(index, len(self.behaviors) - 1)]
+        return behavior(self)
+
+
+@pytest.fixture
+def make_generator(tmp_path, monkeypatch):
+    """创建使用替身客户端、独立熔断器和临时输出目录的生成器"""
+    monkeypatch.setattr(settings, "OUTPUT_DIR", tmp_path)
+    generators = []
+
+    def factory(client=None, request_timeout=5.0, **breaker_kwargs):
+        generator = GeminiImageGenerator(api_key="test")
+        generator._client = client
+        generator._types = FakeTypes
+        generator.request_timeout = request_timeout
+        generator.breaker = CircuitBreaker("test", **breaker_kwargs)
+        generators.append(generator)
+        return generator
+
+    yield factory
+    for generator in generators:
+        if isinstance(generator._client, FakeClient):
+            generator._client.release.set()
+        generator.close()
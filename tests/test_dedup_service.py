@@ -0,0 +1,159 @@
+"""去重索引测试：BK 树检索、完全重复、多 worker 共享日志"""
+import hashlib
+import random
+
+from services.dedup_service import BKTree, DedupService, hamming_distance
+
+
+def _service(tmp_path) -> DedupService:
+    output_dir = tmp_path / "images"
+    output_dir.mkdir(exist_ok=True)
+    return DedupService(index_file=tmp_path / "dedup" / "index.jsonl", output_dir=output_dir)
+
+
+def _write(service: DedupService, filename: str, data: bytes):
+    (service.output_dir / filename).write_bytes(data)
+
+
+def test_bk_tree_matches_brute_force():
+    rng = random.Random(42)
+    base = [rng.getrandbits(64) for _ in range(20)]
+    # 在随机基准附近翻转少量比特，制造相近的哈希
+    values = []
+    for value in base:
+        values.append(value)
+        for _ in range(10):
+            for bit in rng.sample(range(64), rng.randint(1, 12)):
+                value ^= 1 << bit
+            values.append(value)
+
+    tree = BKTree()
+    for index, value in enumerate(values):
+        tree.add(value, f"img_{index}")
+
+    for query in rng.sample(values, 25) + [rng.getrandbits(64) for _ in range(5)]:
+        for max_distance in (0, 4, 10, 20):
+            expected = sorted(
+                (hamming_distance(query, value), f"img_{index}")
+                for index, value in enumerate(values)
+                if hamming_distance(query, value) <= max_distance
+            )
+            assert tree.search(query, max_distance) == expected
+
+
+def test_bk_tree_remove():
+    tree = BKTree()
+    tree.add(0b1010, "a")
+    tree.add(0b1010, "b")
+    tree.add(0b1011, "c")
+    tree.remove(0b1010, "a")
+    assert tree.search(0b1010, 1) == [(0, "b"), (1, "c")]
+
+
+def test_exact_duplicates_rename_and_remove(tmp_path):
+    service = _service(tmp_path)
+    _write(service, "a.png", b"same")
+    _write(service, "b.png", b"same")
+    _write(service, "c.png", b"other")
+
+    assert service.add("a.png")["duplicate_of"] is None
+    assert service.add("b.png")["duplicate_of"] == "a.png"
+    assert service.add("c.png")["duplicate_of"] is None
+
+    # 非图片数据没有 dHash，只能按内容哈希匹配
+    assert service.find_similar("a.png") == [{"filename": "b.png", "distance": 0, "exact": True}]
+    assert service.find_similar("missing.png") is None
+
+    service.rename("b.png", "d.png")
+    assert [item["filename"] for item in service.find_similar("a.png")] == ["d.png"]
+    service.remove("d.png")
+    assert service.find_similar("a.png") == []
+
+
+def test_other_workers_see_appended_entries(tmp_path):
+    """两个实例共享同一个日志文件，模拟两个 worker"""
+    first = _service(tmp_path)
+    second = _service(tmp_path)
+    _write(first, "a.png", b"same")
+    _write(first, "b.png", b"same")
+
+    first.add("a.png")
+    # second 之前没有读过日志，写入前会先读到 first 的记录
+    assert second.add("b.png")["duplicate_of"] == "a.png"
+    assert [item["filename"] for item in first.find_similar("a.png")] == ["b.png"]
+
+    second.remove("b.png")
+    assert first.find_similar("a.png") == []
+
+
+def test_compaction_keeps_entries_from_other_workers(tmp_path):
+    first = _service(tmp_path)
+    second = _service(tmp_path)
+    for index in range(5):
+        _write(first, f"img_{index}.png", f"data-{index}".encode())
+
+    first.add("img_0.png")
+    # 制造大量冗余日志，触发 first 压缩
+    for _ in range(600):
+        first.remove("img_0.png")
+        first.add("img_0.png")
+    second.add("img_1.png")
+    for _ in range(600):
+        first.remove("img_0.png")
+        first.add("img_0.png")
+
+    lines = (tmp_path / "dedup" / "index.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(lines) < 1200
+    # 压缩后 second 的记录仍然存在，且 second 能正确重新加载
+    assert second.find_similar("img_1.png") == []
+    assert first.find_similar("img_1.png") == []
+    assert DedupService(first.index_file, first.output_dir).find_similar("img_0.png") == []
+
+
+def test_sync_directory_indexes_only_changes(tmp_path):
+    first = _service(tmp_path)
+    _write(first, "a.png", b"same")
+    _write(first, "b.png", b"same")
+    assert first.sync_directory() == {"added": 2, "removed": 0, "skipped": False}
+
+    # 另一个 worker 启动时从共享日志读取，不会重复索引
+    second = _service(tmp_path)
+    assert second.sync_directory() == {"added": 0, "removed": 0, "skipped": False}
+
+    (first.output_dir / "b.png").unlink()
+    assert second.sync_directory() == {"added": 0, "removed": 1, "skipped": False}
+    assert first.find_similar("a.png") == []
+
+
+def _tree_size(tree: BKTree) -> int:
+    stack = [tree._root] if tree._root else []
+    count = 0
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children.values())
+    return count
+
+
+def test_compaction_rebuilds_bk_tree(tmp_path, monkeypatch):
+    """删除留下的空节点在压缩时被丢弃"""
+    monkeypatch.setattr(
+        "services.dedup_service.compute_dhash",
+        lambda data: int.from_bytes(hashlib.sha256(data).digest()[:8], "big")
+    )
+    service = _service(tmp_path)
+    _write(service, "keep.png", b"keep")
+    service.add("keep.png")
+    compacted = False
+    for index in range(600):
+        _write(service, "churn.png", f"churn-{index}".encode())
+        service.add("churn.png")
+        service.remove("churn.png")
+        if service._log_lines == 1:
+            # 刚刚压缩：只剩 keep.png 的记录，空节点全部丢弃
+            compacted = True
+            break
+
+    assert compacted
+    assert _tree_size(service._tree) == 1
+    assert service.find_similar("keep.png", max_distance=64) == []
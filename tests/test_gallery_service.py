@@ -0,0 +1,145 @@
+"""图片库增量列表测试：游标、删除记录、多 worker 共享"""
+import os
+
+from services.gallery_service import GalleryService
+
+
+def _service(tmp_path) -> GalleryService:
+    output_dir = tmp_path / "images"
+    output_dir.mkdir(exist_ok=True)
+    return GalleryService(output_dir=output_dir, log_file=tmp_path / "gallery" / "changes.jsonl")
+
+
+def _save(service: GalleryService, filename: str):
+    (service.output_dir / filename).write_bytes(b"png")
+    service.record(filename)
+
+
+def _names(result: dict) -> list[str]:
+    return [image["filename"] for image in result["images"]]
+
+
+def test_full_list_then_delta(tmp_path):
+    service = _service(tmp_path)
+    (service.output_dir / "a.png").write_bytes(b"png")
+
+    full = service.list_images()
+    assert full["reset"] is True
+    assert _names(full) == ["a.png"]
+
+    _save(service, "b.png")
+    delta = service.list_images(full["cursor"])
+    assert delta["reset"] is False
+    assert _names(delta) == ["b.png"]
+    assert delta["removed"] == []
+
+    # 没有变化时返回空增量，游标不变
+    empty = service.list_images(delta["cursor"])
+    assert _names(empty) == [] and empty["removed"] == []
+    assert empty["cursor"] == delta["cursor"]
+
+
+def test_rename_produces_tombstone(tmp_path):
+    service = _service(tmp_path)
+    _save(service, "a.png")
+    cursor = service.list_images()["cursor"]
+
+    (service.output_dir / "a.png").rename(service.output_dir / "b.png")
+    service.rename("a.png", "b.png")
+    delta = service.list_images(cursor)
+    assert _names(delta) == ["b.png"]
+    assert delta["removed"] == ["a.png"]
+
+    # 删除后又重新出现的文件不再出现在删除列表中
+    _save(service, "a.png")
+    delta = service.list_images(cursor)
+    assert _names(delta) == ["a.png", "b.png"]
+    assert delta["removed"] == []
+
+
+def test_invalid_or_expired_cursor_resets(tmp_path, monkeypatch):
+    service = _service(tmp_path)
+    _save(service, "a.png")
+    cursor = service.list_images()["cursor"]
+
+    for bad in ("", "garbage", "deadbeef:1", cursor.split(":")[0] + ":999"):
+        assert service.list_images(bad)["reset"] is True
+
+    # 删除记录超出上限后，更早的游标无法给出完整的删除列表
+    monkeypatch.setattr(GalleryService, "MAX_TOMBSTONES", 2)
+    for index in range(3):
+        _save(service, f"tmp_{index}.png")
+    for index in range(3):
+        service.rename(f"tmp_{index}.png", f"renamed_{index}.png")
+    result = service.list_images(cursor)
+    assert result["reset"] is True
+
+
+def test_cursor_shared_between_workers(tmp_path):
+    """两个实例共享同一个输出目录和变更日志，模拟两个 worker"""
+    first = _service(tmp_path)
+    second = _service(tmp_path)
+    _save(first, "a.png")
+
+    cursor = first.list_images()["cursor"]
+    _save(second, "b.png")
+
+    # first 签发的游标在 second 上同样有效，反之亦然
+    delta = second.list_images(cursor)
+    assert delta["reset"] is False
+    assert _names(delta) == ["b.png"]
+
+    second.rename("a.png", "c.png")
+    delta = first.list_images(delta["cursor"])
+    assert delta["reset"] is False
+    assert _names(delta) == ["c.png"]
+    assert delta["removed"] == ["a.png"]
+
+
+def test_cursor_survives_restart(tmp_path):
+    service = _service(tmp_path)
+    _save(service, "a.png")
+    cursor = service.list_images()["cursor"]
+
+    restarted = _service(tmp_path)
+    _save(restarted, "b.png")
+    delta = restarted.list_images(cursor)
+    assert delta["reset"] is False
+    assert _names(delta) == ["b.png"]
+
+
+def test_compaction_resets_cursors(tmp_path, monkeypatch):
+    monkeypatch.setattr(GalleryService, "MAX_TOMBSTONES", 5)
+    first = _service(tmp_path)
+    second = _service(tmp_path)
+    _save(first, "a.png")
+    cursor = second.list_images()["cursor"]
+
+    # 反复记录同一张图片，日志增长到超过阈值后被重建
+    for _ in range(20):
+        first.record("a.png")
+
+    lines = (tmp_path / "gallery" / "changes.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(lines) < 20
+    result = second.list_images(cursor)
+    assert result["reset"] is True
+    assert _names(result) == ["a.png"]
+
+
+def test_created_at_survives_hardlink(tmp_path):
+    """文件被替换为指向旧文件的硬链接后，仍按保存时间排序，且不被当作外部修改"""
+    service = _service(tmp_path)
+    old = service.output_dir / "old.png"
+    old.write_bytes(b"png")
+    os.utime(old, (1000.0, 1000.0))
+    service.record("old.png")
+
+    new = service.output_dir / "new.png"
+    new.write_bytes(b"png")
+    saved_at = new.stat().st_mtime
+    os.link(old, service.output_dir / ".new.link")
+    os.replace(service.output_dir / ".new.link", new)
+    service.record("new.png", saved_at)
+
+    images = {img["filename"]: img["created_at"] for img in service.list_images()["images"]}
+    assert images == {"old.png": 1000.0, "new.png": saved_at}
@@ -0,0 +1,157 @@
+"""GeminiImageGenerator 测试：对冲、超时、熔断与本地错误分类"""
+import asyncio
+import threading
+
+from config import settings
+from generators.resilience import CircuitBreaker
+
+from tests.conftest import FakeClient, image_response
+
+
+def _blocked(client):
+    """一直等到测试结束才返回"""
+    client.release.wait(10)
+    return image_response()
+
+
+def _ok(client):
+    return image_response()
+
+
+def _network_error(client):
+    raise ConnectionError("connection reset")
+
+
+def _slow_network_error(client):
+    client.release.wait(0.2)
+    raise ConnectionError("connection reset")
+
+
+def test_success_saves_image(make_generator, tmp_path):
+    generator = make_generator(FakeClient(_ok))
+    result = asyncio.run(generator.generate_image("cat", filename="cat.png"))
+    assert result["success"] is True
+    assert result["filename"] == "cat.png"
+    assert (tmp_path / "cat.png").read_bytes() == image_response().candidates[0].content.parts[0].inline_data.data
+
+
+def test_hedge_wins_after_delay(make_generator, monkeypatch):
+    monkeypatch.setattr(settings, "HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(settings, "HEDGE_MIN_SAMPLES", 1000)
+    client = FakeClient(_blocked, _ok)
+    generator = make_generator(client)
+
+    result = asyncio.run(generator.generate_image("cat", hedge=True))
+    assert result["success"] is True
+    # 首个请求超过对冲延迟仍未返回，第二个请求先完成
+    assert client.calls == 2
+    assert generator.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_no_hedge_when_disabled(make_generator, monkeypatch):
+    monkeypatch.setattr(settings, "HEDGE_DELAY", 0.01)
+    client = FakeClient(_ok)
+    generator = make_generator(client)
+    assert asyncio.run(generator.generate_image("cat"))["success"] is True
+    assert client.calls == 1
+
+
+def test_hedge_both_fail(make_generator, monkeypatch):
+    monkeypatch.setattr(settings, "HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(settings, "HEDGE_MIN_SAMPLES", 1000)
+    client = FakeClient(_slow_network_error, _network_error)
+    generator = make_generator(client, failure_threshold=2)
+
+    result = asyncio.run(generator.generate_image("cat", hedge=True))
+    assert result["success"] is False
+    assert result["error_code"] == "network_error"
+    assert client.calls == 2
+    # 一次逻辑调用只计一次失败
+    assert generator.breaker.state == CircuitBreaker.CLOSED
+    generator.breaker.record_failure()
+    assert generator.breaker.state == CircuitBreaker.OPEN
+
+
+def test_overall_timeout(make_generator):
+    generator = make_generator(FakeClient(_blocked), request_timeout=0.1, failure_threshold=1)
+    result = asyncio.run(generator.generate_image("cat"))
+    assert result["success"] is False
+    assert result["error_code"] == "timeout"
+    assert generator.breaker.state == CircuitBreaker.OPEN
+
+
+def test_open_circuit_returns_retry_after(make_generator):
+    client = FakeClient(_ok)
+    generator = make_generator(client, failure_threshold=1, recovery_timeout=30)
+    generator.breaker.record_failure()
+
+    result = asyncio.run(generator.generate_image("cat"))
+    assert result["success"] is False
+    assert result["error_code"] == "circuit_open"
+    assert 1 <= result["retry_after"] <= 30
+    # 熔断时不调用上游
+    assert client.calls == 0
+
+
+def test_save_failure_is_classified(make_generator):
+    generator = make_generator(FakeClient(_ok), failure_threshold=1)
+
+    def disk_full(*args):
+        raise OSError(28, "No space left on device")
+
+    generator._save_image = disk_full
+    result = asyncio.run(generator.generate_image("cat"))
+    assert result["success"] is False
+    assert result["error_code"] == "save_failed"
+    # 本地写盘失败不计入熔断
+    assert generator.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_invalid_image_data_is_classified(make_generator):
+    generator = make_generator(FakeClient(lambda client: image_response("not base64!")))
+    result = asyncio.run(generator.generate_image("cat"))
+    assert result["success"] is False
+    assert result["error_code"] == "invalid_image_data"
+
+
+def test_client_init_failure_is_classified(make_generator):
+    generator = make_generator(None)
+
+    def broken():
+        raise ImportError("No module named 'google.genai'")
+
+    generator._ensure_client = broken
+    result = asyncio.run(generator.generate_image("cat"))
+    assert result["success"] is False
+    assert result["error_code"] == "client_unavailable"
+    assert generator.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_ready_after_connection_warm_up(make_generator):
+    """客户端创建后、连接预热结束前仍未就绪"""
+    async def scenario():
+        client = FakeClient(_ok)
+        connected = threading.Event()
+        client.models.get = lambda model: connected.wait(5)
+        generator = make_generator(client)
+        task = asyncio.create_task(generator.warm_up(connect=True))
+        await asyncio.sleep(0.05)
+        assert generator._client is not None
+        assert generator.ready is False
+        connected.set()
+        await task
+        return generator.ready
+
+    assert asyncio.run(scenario()) is True
+
+
+def test_ready_after_failed_warm_up(make_generator):
+    client = FakeClient(_ok)
+
+    def unreachable(model):
+        raise ConnectionError("unreachable")
+
+    client.models.get = unreachable
+    generator = make_generator(client)
+    asyncio.run(generator.warm_up(connect=True))
+    assert generator.ready is True
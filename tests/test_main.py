@@ -0,0 +1,89 @@
+"""API 层测试"""
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import main
+from services.dedup_service import DedupService
+from services.gallery_service import GalleryService
+from services.scheduler import GenerationScheduler
+
+from tests.conftest import FakeClient, image_response
+
+
+def _request(headers: dict) -> Request:
+    return Request({
+        "type": "http",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "client": ("10.0.0.1", 12345)
+    })
+
+
+def test_client_id_only_trusts_configured_tokens(monkeypatch):
+    monkeypatch.setattr(main, "_CLIENT_WEIGHTS", {main._token_id("known"): 3.0})
+
+    known = main._client_id(_request({"Authorization": "Bearer known"}))
+    assert known == main._token_id("known")
+    assert "known" not in known
+    assert main._client_id(_request({"X-API-Key": "known"})) == known
+
+    # 未配置的 token（例如每次随机生成）按 IP 归为同一个客户端
+    assert main._client_id(_request({"Authorization": "Bearer random-1"})) == "10.0.0.1"
+    assert main._client_id(_request({"X-API-Key": "random-2"})) == "10.0.0.1"
+    assert main._client_id(_request({})) == "10.0.0.1"
+
+
+@pytest.fixture
+def client(make_generator, tmp_path, monkeypatch):
+    """不经过 lifespan，直接注入替身生成器的测试客户端"""
+    def factory(generator):
+        monkeypatch.setattr(main, "generator", generator)
+        monkeypatch.setattr(main, "scheduler", GenerationScheduler())
+        main.app.state.gallery_service = GalleryService(tmp_path, tmp_path / "gallery" / "changes.jsonl")
+        return TestClient(main.app)
+    return factory
+
+
+def test_circuit_open_sends_retry_after(client, make_generator):
+    generator = make_generator(FakeClient(lambda c: image_response()), failure_threshold=1, recovery_timeout=30)
+    generator.breaker.record_failure()
+
+    response = client(generator).post("/api/generate", json={"prompt": "cat"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["error_code"] == "circuit_open"
+    assert 1 <= body["retry_after"] <= 30
+    assert response.headers["Retry-After"] == str(body["retry_after"])
+
+
+def test_batch_keeps_results_when_one_save_fails(client, make_generator):
+    generator = make_generator(FakeClient(lambda c: image_response()))
+    save_image = generator._save_image
+
+    def save_or_fail(image_data, prompt, aspect_ratio, filename=None):
+        if prompt == "bad":
+            raise OSError(28, "No space left on device")
+        return save_image(image_data, prompt, aspect_ratio, filename)
+
+    generator._save_image = save_or_fail
+    response = client(generator).post("/api/generate/batch", json={"prompts": ["a", "bad", "b"]})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["succeeded"], body["failed"]) == (2, 1)
+    assert [r["error_code"] for r in body["results"]] == [None, "save_failed", None]
+
+
+def test_rename_updates_indexes(client, make_generator, tmp_path):
+    test_client = client(make_generator(FakeClient(lambda c: image_response())))
+    main.app.state.dedup_service = DedupService(tmp_path / "dedup" / "index.jsonl", tmp_path)
+    (tmp_path / "a.png").write_bytes(b"png")
+    main.app.state.dedup_service.add("a.png")
+    cursor = test_client.get("/api/images").json()["cursor"]
+
+    response = test_client.post("/api/rename", json={"old_filename": "a.png", "new_filename": "b"})
+    assert response.json()["filename"] == "b.png"
+    assert main.app.state.dedup_service.find_similar("b.png") == []
+
+    delta = test_client.get("/api/images", params={"since": cursor}).json()
+    assert [img["filename"] for img in delta["images"]] == ["b.png"]
+    assert delta["removed"] == ["a.png"]
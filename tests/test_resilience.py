@@ -0,0 +1,124 @@
+"""熔断器状态转换、错误分类与延迟统计测试"""
+import asyncio
+
+from generators.resilience import CircuitBreaker, ErrorKind, LatencyTracker, classify_error
+
+
+class _Clock:
+    """可手动推进的 time.monotonic 替身"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _breaker(monkeypatch, **kwargs) -> tuple[CircuitBreaker, _Clock]:
+    clock = _Clock()
+    monkeypatch.setattr("generators.resilience.time.monotonic", clock)
+    return CircuitBreaker("test", **kwargs), clock
+
+
+def test_opens_after_consecutive_failures(monkeypatch):
+    breaker, _ = _breaker(monkeypatch, failure_threshold=3, recovery_timeout=30)
+    for _ in range(2):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.retry_after() == 30
+
+
+def test_success_resets_failure_count(monkeypatch):
+    breaker, _ = _breaker(monkeypatch, failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_after_recovery_timeout(monkeypatch):
+    breaker, clock = _breaker(monkeypatch, failure_threshold=1, recovery_timeout=30)
+    breaker.record_failure()
+
+    clock.now += 10
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == 20
+
+    clock.now += 20
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 半开状态只放行一个探测请求
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_half_open_probe_success_closes(monkeypatch):
+    breaker, clock = _breaker(monkeypatch, failure_threshold=1, recovery_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_half_open_probe_failure_reopens(monkeypatch):
+    breaker, clock = _breaker(monkeypatch, failure_threshold=5, recovery_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow_request()
+    # 半开状态下一次失败即重新熔断，并重新计算冷却时间
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == 30
+
+
+def test_release_returns_probe_slot(monkeypatch):
+    breaker, clock = _breaker(monkeypatch, failure_threshold=1, recovery_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.release()
+    assert breaker.allow_request()
+
+
+class _APIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"status {code}")
+        self.code = code
+
+
+class ConnectTimeout(Exception):
+    pass
+
+
+class ConnectError(Exception):
+    pass
+
+
+def test_classify_error():
+    assert classify_error(asyncio.TimeoutError()) is ErrorKind.TIMEOUT
+    assert classify_error(_APIError(429)) is ErrorKind.RATE_LIMITED
+    assert classify_error(_APIError(403)) is ErrorKind.AUTH_ERROR
+    assert classify_error(_APIError(400)) is ErrorKind.INVALID_REQUEST
+    assert classify_error(_APIError(503)) is ErrorKind.UPSTREAM_ERROR
+    assert classify_error(ConnectTimeout()) is ErrorKind.TIMEOUT
+    assert classify_error(ConnectError()) is ErrorKind.NETWORK_ERROR
+    assert classify_error(ConnectionResetError()) is ErrorKind.NETWORK_ERROR
+    assert classify_error(ValueError()) is ErrorKind.UNKNOWN
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker(window=100)
+    assert tracker.percentile(95) is None
+    for value in range(1, 101):
+        tracker.record(float(value))
+    assert len(tracker) == 100
+    assert tracker.percentile(50) == 50.0
+    assert tracker.percentile(95) == 95.0
@@ -0,0 +1,164 @@
+"""GenerationScheduler 测试：公平排队、准入控制、取消与指标"""
+import asyncio
+
+import pytest
+
+from services.scheduler import GenerationScheduler, Priority, QueueFullError
+
+
+def _stats(scheduler: GenerationScheduler, priority: Priority) -> dict:
+    return scheduler.get_stats()["classes"][priority.value]
+
+
+def test_weighted_fair_queuing_interleaves_clients():
+    """单并发下，两个客户端的任务按权重交替执行，而不是先到先得"""
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, bulk_max_concurrency=1, client_weights={"b": 2})
+        gate = asyncio.Event()
+        order = []
+
+        def job(name):
+            async def run():
+                await gate.wait()
+                order.append(name)
+            return run
+
+        futures = scheduler.submit_many([job(f"a{i}") for i in range(4)], "a")
+        futures += scheduler.submit_many([job(f"b{i}") for i in range(4)], "b")
+        gate.set()
+        await asyncio.gather(*futures)
+        return order
+
+    order = asyncio.run(scenario())
+    # 虚拟完成时间：a 为 1, 2, 3, 4；b 的权重为 2，为 0.5, 1, 1.5, 2（相同时先提交的优先）
+    # a0 提交时槽位空闲，立即执行
+    assert order == ["a0", "b0", "b1", "b2", "a1", "b3", "a2", "a3"]
+
+
+def test_interactive_preempts_bulk_queue():
+    """交互式任务优先于已经排队的批量任务"""
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, bulk_max_concurrency=1)
+        gate = asyncio.Event()
+        order = []
+
+        def job(name):
+            async def run():
+                await gate.wait()
+                order.append(name)
+            return run
+
+        futures = scheduler.submit_many([job("bulk0"), job("bulk1")], "a", Priority.BULK)
+        futures += scheduler.submit_many([job("interactive")], "b", Priority.INTERACTIVE)
+        gate.set()
+        await asyncio.gather(*futures)
+        return order
+
+    assert asyncio.run(scenario()) == ["bulk0", "interactive", "bulk1"]
+
+
+def test_admission_rejects_whole_batch():
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, queue_limits={Priority.BULK: 3})
+        gate = asyncio.Event()
+
+        async def blocked():
+            await gate.wait()
+
+        futures = scheduler.submit_many([blocked], "a")
+        futures += scheduler.submit_many([blocked] * 3, "a")
+        # 1 个在执行，3 个排队，队列已满
+        with pytest.raises(QueueFullError) as exc_info:
+            scheduler.submit_many([blocked], "b")
+        assert exc_info.value.retry_after >= 1
+        stats = _stats(scheduler, Priority.BULK)
+        gate.set()
+        await asyncio.gather(*futures)
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["queue_depth"] == 3
+    assert stats["rejected"] == 1
+    assert stats["admitted"] == 4
+
+
+def test_per_client_queue_limit():
+    """单个客户端的排队配额用完后，其他客户端仍然可以入队"""
+    async def scenario():
+        scheduler = GenerationScheduler(
+            max_concurrency=1,
+            queue_limits={Priority.BULK: 10},
+            client_queue_limits={Priority.BULK: 2}
+        )
+        gate = asyncio.Event()
+
+        async def blocked():
+            await gate.wait()
+
+        assert scheduler.capacity(Priority.BULK) == 2
+        futures = scheduler.submit_many([blocked], "a")
+        futures += scheduler.submit_many([blocked] * 2, "a")
+        with pytest.raises(QueueFullError):
+            scheduler.submit_many([blocked], "a")
+        futures += scheduler.submit_many([blocked] * 2, "b")
+        stats = _stats(scheduler, Priority.BULK)
+        gate.set()
+        await asyncio.gather(*futures)
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["queue_depth"] == 4
+    assert stats["queued_clients"] == 2
+
+
+def test_cancelled_jobs_release_admission():
+    """排队期间取消的任务立即归还名额，并单独计数"""
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1, queue_limits={Priority.BULK: 2})
+        gate = asyncio.Event()
+        started = []
+
+        def job(name):
+            async def run():
+                started.append(name)
+                await gate.wait()
+            return run
+
+        running = scheduler.submit_many([job("running")], "a")
+        queued = scheduler.submit_many([job("q0"), job("q1")], "a")
+        for future in queued:
+            future.cancel()
+        # 让 Future 的完成回调执行
+        await asyncio.sleep(0)
+
+        stats = _stats(scheduler, Priority.BULK)
+        assert stats["queue_depth"] == 0
+        assert stats["cancelled"] == 2
+
+        # 取消后的名额可以被重新使用
+        more = scheduler.submit_many([job("q2"), job("q3")], "b")
+        gate.set()
+        await asyncio.gather(*running, *more)
+        return started, _stats(scheduler, Priority.BULK)
+
+    started, stats = asyncio.run(scenario())
+    assert started == ["running", "q2", "q3"]
+    assert stats["admitted"] == 5
+    assert stats["admitted"] == stats["completed"] + stats["cancelled"] + stats["queue_depth"] + stats["running"]
+
+
+def test_exceptions_are_forwarded_and_counted():
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=2)
+
+        async def boom():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            await scheduler.run(boom, "a")
+        return _stats(scheduler, Priority.INTERACTIVE)
+
+    stats = asyncio.run(scenario())
+    assert stats["completed"] == 1
+    assert stats["running"] == 0
+    assert stats["queue_depth"] == 0